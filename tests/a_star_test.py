@@ -0,0 +1,52 @@
+import unittest
+
+import numpy
+
+from worldengine.a_star import AStar, PathFinder
+
+
+class TestAStar(unittest.TestCase):
+
+    def test_rectangular_map(self):
+        # wider than high: the low cells go around the ridge at x = 3
+        heightmap = numpy.ones((3, 7))
+        heightmap[0:2, 3] = 9
+        path = PathFinder().find(heightmap, [0, 0], [6, 0])
+        self.assertEqual([6, 0], path[-1])
+        self.assertIn([3, 2], path)
+        self.assertEqual(10, len(path))
+        # higher than wide
+        path = PathFinder().find(numpy.ones((7, 3)), [2, 0], [2, 6])
+        self.assertEqual([[2, y] for y in range(1, 7)], path)
+
+    def test_wrap(self):
+        heightmap = numpy.ones((2, 8))
+        path = AStar(heightmap, wrap=True).find([1, 0], [6, 0])
+        self.assertEqual([[0, 0], [7, 0], [6, 0]], path)
+        path = AStar(heightmap).find([1, 0], [6, 0])
+        self.assertEqual([[x, 0] for x in range(2, 7)], path)
+
+    def test_reuse(self):
+        heightmap = numpy.ones((3, 3))
+        heightmap[1, 1] = 0
+        finder = PathFinder()
+        self.assertEqual([[1, 1], [1, 2]], finder.find(heightmap, [1, 0],
+                                                       [1, 2]))
+        astar = finder._astar
+        # the change in place is seen by the next search
+        heightmap[1, 1] = 9
+        path = finder.find(heightmap, [1, 0], [1, 2])
+        self.assertIs(astar, finder._astar)
+        self.assertNotIn([1, 1], path)
+        self.assertEqual(4, len(path))
+
+    def test_no_path(self):
+        heightmap = numpy.ones((5, 5))
+        astar = AStar(heightmap, max_expansions=3)
+        self.assertEqual([], astar.find([0, 0], [4, 4]))
+        self.assertEqual([], astar.find([0, 0], [5, 0]))
+        self.assertEqual([], astar.find([0, 0], [0, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from worldengine.checkpoint import *
+from worldengine.plates import world_gen
+from worldengine.world import World
+from worldengine.step import Step
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def test_checkpoint_after_each_stage(self):
+        w = world_gen("Dummy", 32, 16, 1, step=Step.full(),
+                      checkpoint_dir=self.checkpoint_dir)
+        self.assertEqual('biome',
+                         checkpoint_stage(self.checkpoint_dir, "Dummy"))
+        loaded = load_checkpoint(self.checkpoint_dir, "Dummy", 32, 16, 1,
+                                 10, 1.0, Step.full())
+        self.assertEqual(w, loaded)
+        self.assertRaises(Exception, load_checkpoint, self.checkpoint_dir,
+                          "Dummy", 32, 16, 2, 10, 1.0, Step.full())
+        self.assertEqual(None, load_checkpoint(self.checkpoint_dir, "Foo",
+                                               32, 16, 1, 10, 1.0,
+                                               Step.full()))
+
+    def test_stages_in_a_row(self):
+        w = World("Dummy", 16, 8, 1, 10, 1.0, Step.full())
+        name = os.name
+        try:
+            # the files of the checkpoint have to be replaced also on Windows
+            os.name = 'nt'
+            save_checkpoint(self.checkpoint_dir, w, 'plates')
+            save_checkpoint(self.checkpoint_dir, w, 'initial')
+        finally:
+            os.name = name
+        self.assertEqual('initial',
+                         checkpoint_stage(self.checkpoint_dir, "Dummy"))
+        self.assertEqual(['Dummy.checkpoint', 'Dummy.checkpoint.json'],
+                         sorted(os.listdir(self.checkpoint_dir)))
+
+    def test_resume(self):
+        w = world_gen("Dummy", 32, 16, 1, step=Step.full(),
+                      checkpoint_dir=self.checkpoint_dir)
+        # as if the generation was interrupted after the temperature
+        partial = load_checkpoint(self.checkpoint_dir, "Dummy", 32, 16, 1,
+                                  10, 1.0, Step.full())
+        del partial.permeability
+        del partial.biome
+        save_checkpoint(self.checkpoint_dir, partial, 'temperature')
+
+        resumed = world_gen("Dummy", 32, 16, 1, step=Step.full(),
+                            checkpoint_dir=self.checkpoint_dir, resume=True)
+        self.assertEqual(w, resumed)
+        self.assertEqual('biome',
+                         checkpoint_stage(self.checkpoint_dir, "Dummy"))
+
+
+if __name__ == '__main__':
+    unittest.main()
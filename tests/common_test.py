@@ -1,4 +1,8 @@
+import os
+import shutil
+import tempfile
 import unittest
+import numpy
 from worldengine.common import *
 
 
@@ -14,6 +18,17 @@ class TestCommon(unittest.TestCase):
         set_verbose(False)
         self.assertEqual(False, get_verbose())
 
+    def test_for_each_band(self):
+        rows = []
+        set_workers(3)
+        try:
+            for_each_band(10, lambda y_start, y_end: rows.extend(
+                range(y_start, y_end)))
+        finally:
+            set_workers(1)
+        self.assertEqual(list(range(10)), sorted(rows))
+        self.assertRaises(Exception, set_workers, 0)
+
     def test_matrix_min_and_max(self):
         m1 = [
             [-0.8, -0.5, 1.0, 2.6],
@@ -69,10 +84,40 @@ class TestCommon(unittest.TestCase):
         antialiased = antialias(original, 10)
         self.assertAlmostEquals(0.8, antialiased[0][0])
 
+    def test_antialias_closed_form(self):
+        original = numpy.random.RandomState(3).rand(7, 10)
+        for steps in [0, 1, 10]:
+            self.assertTrue(numpy.allclose(
+                antialias(original, steps),
+                antialias(original, steps, closed_form=True),
+                rtol=0.0, atol=1e-12))
+        self.assertTrue(numpy.allclose(antialias([[0.5, 0.25]], 3),
+                                       antialias([[0.5, 0.25]], 3, True)))
+
     def test_array_to_matrix(self):
         array = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
         self.assertEqual([[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]], array_to_matrix(array, 5, 2))
         self.assertEqual([[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]], array_to_matrix(array, 2, 5))
 
+    def test_replace_file(self):
+        directory = tempfile.mkdtemp()
+        name = os.name
+        try:
+            path = os.path.join(directory, 'file')
+            for system in ['posix', 'nt']:
+                # on Windows the existing file has to be removed first
+                os.name = system
+                for content in ['first', 'second']:
+                    source = os.path.join(directory, 'tmp')
+                    with open(source, 'w') as f:
+                        f.write(content)
+                    replace_file(source, path)
+                    with open(path) as f:
+                        self.assertEqual(content, f.read())
+            self.assertEqual(['file'], os.listdir(directory))
+        finally:
+            os.name = name
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()
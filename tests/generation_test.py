@@ -2,6 +2,7 @@ import unittest
 from worldengine.generation import *
 from worldengine.plates import *
 import tempfile
+import numpy
 
 from tests.draw_test import TestBase
 
@@ -38,6 +39,71 @@ class TestGeneration(TestBase):
         el_after = TestGeneration._mean_elevation_at_borders(w)
         self.assertTrue(el_after <= el_before)
 
+    def test_center_land_moves_plates_with_elevation(self):
+        w = World("Foo", 4, 3, 1, 10, 1.0, Step.full())
+        w.set_elevation([[5, 1, 5, 5], [0, 0, 0, 0], [5, 1, 5, 5]], None)
+        w.set_plates([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]])
+        center_land(w)
+        self.assertEqual([[0, 0, 0, 0], [1, 5, 5, 5], [1, 5, 5, 5]],
+                         w.elevation['data'].tolist())
+        self.assertEqual([[5, 6, 7, 4], [9, 10, 11, 8], [1, 2, 3, 0]],
+                         w.plates.tolist())
+
+    def test_place_oceans_at_map_borders(self):
+        w = World("Foo", 20, 10, 1, 10, 1.0, Step.full())
+        w.set_elevation(numpy.ones((10, 20)), None)
+        place_oceans_at_map_borders(w)
+        # the border is 4 cells wide
+        e = w.elevation['data']
+        self.assertEqual(0.0, e[0, 10])
+        self.assertEqual(0.0, e[5, 19])
+        self.assertAlmostEqual(0.5, e[2, 10])
+        self.assertAlmostEqual(0.75 * 0.25, e[8, 3])
+        self.assertEqual(1.0, e[5, 10])
+
+    def test_fill_ocean(self):
+        elevation = [[0, 0, 5, 5, 5, 0],
+                     [5, 5, 5, 0, 5, 5],
+                     [5, 0, 5, 5, 0, 5],
+                     [5, 5, 5, 5, 5, 0]]
+        ocean, basins = fill_ocean(elevation, 1.0)
+        self.assertEqual([[True, True, False, False, False, True],
+                          [False, False, False, True, False, False],
+                          [False, False, False, False, True, False],
+                          [False, False, False, False, False, True]],
+                         ocean.tolist())
+        # the lake is not part of any basin
+        self.assertEqual([[1, 1, 0, 0, 0, 2],
+                          [0, 0, 0, 3, 0, 0],
+                          [0, 0, 0, 0, 3, 0],
+                          [0, 0, 0, 0, 0, 3]],
+                         basins.tolist())
+
+    def test_ocean_basins_are_kept(self):
+        w = world_gen("Dummy", 32, 16, 1, step=Step.get_by_name("plates"))
+        self.assertTrue(w.has_ocean_basins())
+        self.assertTrue((w.ocean_basins[w.ocean] > 0).all())
+        self.assertFalse(w.ocean_basins[~w.ocean].any())
+        # the basins are not serialized
+        unserialized = World.protobuf_unserialize(w.protobuf_serialize())
+        self.assertFalse(unserialized.has_ocean_basins())
+        self.assertEqual(w, unserialized)
+        # nor kept when the ocean changes
+        w.set_ocean(w.ocean)
+        self.assertFalse(w.has_ocean_basins())
+
+    def test_sea_depth(self):
+        w = World("Foo", 12, 1, 1, 10, 1.0, Step.full())
+        w.set_elevation([[2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                          0.0, 0.0]], None)
+        w.set_ocean([[False] + [True] * 11])
+        depth = sea_depth(w, 1.0)
+        self.assertEqual((1, 12), depth.shape)
+        self.assertEqual(0.0, depth.min())
+        self.assertEqual(1.0, depth.max())
+        # the depth grows going away from the land
+        self.assertTrue(depth[0, 1] < depth[0, 3] < depth[0, 6])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from noise import snoise2
+
+from worldengine.common import set_workers
+from worldengine.noise_field import noise_map, wrapped_noise_map, \
+    snoise2_field, set_noise_cache
+
+
+class TestNoiseField(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        set_noise_cache(None)
+        shutil.rmtree(self.cache_dir)
+
+    def test_noise_map_matches_snoise2(self):
+        freq = 16.0 * 6
+        n = noise_map(40, 30, freq, 6, 1234)
+        self.assertEqual((30, 40), n.shape)
+        for y in range(30):
+            for x in range(40):
+                self.assertEqual(snoise2(x / freq, y / freq, 6, base=1234),
+                                 n[y, x])
+
+    def test_noise_map_with_workers(self):
+        expected = noise_map(30, 21, 64.0, 6, 5)
+        set_workers(4)
+        try:
+            self.assertTrue(numpy.array_equal(
+                expected, noise_map(30, 21, 64.0, 6, 5)))
+        finally:
+            set_workers(1)
+
+    def test_noise_map_with_one_octave(self):
+        n = noise_map(10, 10, 3.7, 1, 0)
+        self.assertEqual(snoise2(9 / 3.7, 4 / 3.7), n[4, 9])
+
+    def test_wrapped_noise_map_matches_snoise2(self):
+        freq = 16.0 * 6
+        n = wrapped_noise_map(50, 30, freq, 6, 4000)
+        for y in range(30):
+            for x in range(50):
+                self.assertEqual(snoise2(x / freq, y / freq, 6,
+                                         repeatx=50 / freq, base=4000),
+                                 n[y, x])
+
+    def test_wrapped_noise_map_wraps(self):
+        n = snoise2_field([0.0, 0.5, 2.0, 2.5], [0.3], 6, repeatx=2.0,
+                          base=10)
+        self.assertEqual(n[0, 0], n[0, 2])
+        self.assertEqual(n[0, 1], n[0, 3])
+
+    def test_noise_cache(self):
+        expected = noise_map(30, 20, 64.0, 6, 99)
+        set_noise_cache(self.cache_dir)
+        first = noise_map(30, 20, 64.0, 6, 99)
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        second = noise_map(30, 20, 64.0, 6, 99)
+        self.assertTrue(isinstance(second, numpy.memmap))
+        self.assertTrue(numpy.array_equal(expected, first))
+        self.assertTrue(numpy.array_equal(expected, second))
+        wrapped_noise_map(30, 20, 64.0, 6, 99)
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_noise_cache_rewrites_broken_entry(self):
+        expected = noise_map(30, 20, 64.0, 6, 99)
+        set_noise_cache(self.cache_dir)
+        noise_map(30, 20, 64.0, 6, 99)
+        entry = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(entry, 'wb') as f:
+            f.write(b'broken')
+        name = os.name
+        try:
+            # replacing the entry has to work also on Windows
+            os.name = 'nt'
+            self.assertTrue(numpy.array_equal(
+                expected, noise_map(30, 20, 64.0, 6, 99)))
+        finally:
+            os.name = name
+        self.assertEqual([os.path.basename(entry)],
+                         os.listdir(self.cache_dir))
+        self.assertTrue(numpy.array_equal(
+            expected, noise_map(30, 20, 64.0, 6, 99)))
+
+    def test_noise_cache_removes_least_recently_used(self):
+        # room for two maps of 40 x 40
+        set_noise_cache(self.cache_dir, max_size=2 * (40 * 40 * 8 + 200))
+        noise_map(40, 40, 64.0, 2, 1)
+        noise_map(40, 40, 64.0, 2, 2)
+        oldest = os.listdir(self.cache_dir)[0]
+        os.utime(os.path.join(self.cache_dir, oldest), (0, 0))
+        noise_map(40, 40, 64.0, 2, 3)
+        entries = os.listdir(self.cache_dir)
+        self.assertEqual(2, len(entries))
+        self.assertFalse(oldest in entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
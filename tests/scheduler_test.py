@@ -0,0 +1,56 @@
+import copy
+import unittest
+
+from worldengine.plates import world_gen
+from worldengine.scheduler import dependencies, run_stages
+from worldengine.simulations.BiomeSimulation import BiomeSimulation
+from worldengine.simulations.ErosionSimulation import ErosionSimulation
+from worldengine.simulations.HumiditySimulation import HumiditySimulation
+from worldengine.simulations.IrrigationSimulation import IrrigationSimulation
+from worldengine.simulations.PermeabilitySimulation import \
+    PermeabilitySimulation
+from worldengine.simulations.PrecipitationSimulation import \
+    PrecipitationSimulation
+from worldengine.simulations.TemperatureSimulation import \
+    TemperatureSimulation
+from worldengine.simulations.WatermapSimulation import WatermapSimulation
+from worldengine.step import Step
+
+
+def _stages():
+    return [('precipitation', PrecipitationSimulation()),
+            ('erosion', ErosionSimulation()),
+            ('watermap', WatermapSimulation()),
+            ('irrigation', IrrigationSimulation()),
+            ('humidity', HumiditySimulation()),
+            ('temperature', TemperatureSimulation()),
+            ('permeability', PermeabilitySimulation()),
+            ('biome', BiomeSimulation())]
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_dependencies(self):
+        deps = dependencies(_stages())
+        self.assertEqual(set(), deps['precipitation'])
+        self.assertEqual(set(), deps['permeability'])
+        self.assertEqual(set(['precipitation']), deps['erosion'])
+        self.assertEqual(set(['precipitation', 'erosion']), deps['watermap'])
+        self.assertEqual(set(['erosion']), deps['temperature'])
+        self.assertEqual(set(['temperature', 'humidity']), deps['biome'])
+
+    def test_concurrent_stages_give_the_same_world(self):
+        w = world_gen("Dummy", 48, 32, 3, step=Step.precipitations())
+        del w.precipitation
+        w.step = Step.full()
+        expected = copy.deepcopy(w)
+        run_stages(expected, _stages(), workers=1)
+
+        results = run_stages(w, _stages(), workers=4)
+        self.assertEqual(expected, w)
+        self.assertEqual(set(name for name, _ in _stages()),
+                         set(results.keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
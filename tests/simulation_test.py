@@ -0,0 +1,204 @@
+import unittest
+import numpy
+
+from worldengine.world import *
+from worldengine.simulations.BiomeSimulation import BiomeSimulation
+from worldengine.simulations.ErosionSimulation import ErosionSimulation, \
+    DIR_NEIGHBORS_CENTER, RiverIndex, _flow_accumulation, in_circle, \
+    priority_flood
+from worldengine.simulations.basic import *
+
+from tests.draw_test import TestBase
+
+
+class TestSimulation(TestBase):
+
+    def setUp(self):
+        super(TestSimulation, self).setUp()
+
+    def test_biome_simulation(self):
+        # the biome stored in the test world was calculated by the per-cell
+        # classification: the table based one has to give the same results
+        w = World.open_protobuf("%s/seed_28070.world" % self.tests_data_dir)
+        expected = w.biome
+        del w.biome
+        cm, biome_cm = BiomeSimulation().execute(w, w.seed)
+        self.assertTrue(numpy.array_equal(expected, w.biome))
+
+        self.assertEqual(w.width * w.height, sum(biome_cm.values()))
+        self.assertEqual(numpy.count_nonzero(w.ocean), biome_cm['ocean'])
+        n_land = w.width * w.height - numpy.count_nonzero(w.ocean)
+        self.assertEqual(n_land, sum([cm[c] for c in TEMPERATURE_CLASSES if c in cm]))
+        self.assertEqual(n_land, sum([cm[c] for c in HUMIDITY_CLASSES if c in cm]))
+
+    def test_water_flow(self):
+        numpy.random.seed(1)
+        w = World("Foo", 13, 7, 1, 10, 1.0, Step.full())
+        # few different elevations, to have cells with equal neighbours
+        w.set_elevation(numpy.random.randint(0, 5, (7, 13)), None)
+        for wrap in [True, False]:
+            erosion = ErosionSimulation()
+            erosion.wrap = wrap
+            water_path = numpy.zeros((13, 7), dtype=int)
+            erosion.find_water_flow(w, water_path)
+            # the direction of the path found cell by cell, if it does not
+            # cross the border of the map
+            for x in range(13):
+                for y in range(7):
+                    path = erosion.find_quick_path([x, y], w)
+                    direction = [path[0] - x, path[1] - y] if path else None
+                    if direction in DIR_NEIGHBORS_CENTER[1:]:
+                        expected = DIR_NEIGHBORS_CENTER.index(direction)
+                    else:
+                        expected = 0
+                    self.assertEqual(expected, water_path[x, y])
+
+    def test_flow_accumulation(self):
+        numpy.random.seed(2)
+        w = World("Foo", 17, 11, 1, 10, 1.0, Step.full())
+        w.set_elevation(numpy.random.randint(0, 9, (11, 17)), None)
+        water_path = numpy.zeros((17, 11), dtype=int)
+        ErosionSimulation().find_water_flow(w, water_path)
+        rain_fall = numpy.random.uniform(0.0, 0.01, (17, 11))
+        flow, inflows = _flow_accumulation(water_path, rain_fall)
+        # follow the path of each cell, adding its rainfall downstream
+        expected = numpy.zeros((17, 11))
+        expected_inflows = numpy.zeros((17, 11), dtype=int)
+        for x in range(17):
+            for y in range(11):
+                cx, cy = x, y
+                expected[cx, cy] += rain_fall[x, y]
+                while water_path[cx, cy] != 0:
+                    dx, dy = DIR_NEIGHBORS_CENTER[water_path[cx, cy]]
+                    if (cx, cy) == (x, y):
+                        expected_inflows[cx + dx, cy + dy] += 1
+                    cx, cy = cx + dx, cy + dy
+                    expected[cx, cy] += rain_fall[x, y]
+        self.assertTrue(numpy.allclose(expected, flow))
+        self.assertTrue(numpy.array_equal(expected_inflows, inflows))
+
+    def test_river_sources(self):
+        w = World.open_protobuf("%s/seed_28070.world" % self.tests_data_dir)
+        erosion = ErosionSimulation()
+        water_path = numpy.zeros((w.width, w.height), dtype=int)
+        water_flow = numpy.zeros((w.width, w.height))
+        erosion.find_water_flow(w, water_path)
+        sources = erosion.river_sources(w, water_flow, water_path)
+        self.assertTrue(len(sources) > 0)
+        for i, (x, y) in enumerate(sources):
+            self.assertTrue(w.is_mountain((x, y)))
+            self.assertTrue(water_flow[x, y] >= 0.02)
+            for sx, sy in sources[:i]:
+                self.assertFalse(in_circle(9, x, y, sx, sy))
+
+    def test_river_index(self):
+        river_list = [[[1, 0], [1, 1], [1, 2], [2, 2]],
+                      [[3, 0], [2, 1], [2, 2], [2, 3]]]
+        index = RiverIndex(4, 4, river_list[:1])
+        index.add(1, river_list[1])
+        self.assertEqual((0, 1), index.find(1, 1))
+        # the first river passing through the cell
+        self.assertEqual((0, 3), index.find(2, 2))
+        self.assertEqual((1, 1), index.find(2, 1))
+        self.assertEqual(None, index.find(0, 0))
+        self.assertEqual(None, index.find(-1, 0))
+
+        # a river next to another one merges into it
+        w = World("Foo", 4, 4, 1, 10, 1.0, Step.full())
+        erosion = ErosionSimulation()
+        erosion.wrap = False
+        self.assertEqual([[0, 1], [1, 1], [1, 2], [2, 2]],
+                         erosion.river_flow([0, 1], w, river_list, []))
+        # the neighbours are checked from the north, clockwise
+        self.assertEqual([[3, 1], [3, 0], [2, 1], [2, 2], [2, 3]],
+                         erosion.river_flow([3, 1], w, river_list, [],
+                                            index))
+
+    def test_priority_flood(self):
+        numpy.random.seed(3)
+        elevation = numpy.random.uniform(0.0, 10.0, (9, 12))
+        ocean = numpy.zeros((9, 12), dtype=bool)
+        ocean[0, :4] = True
+        ocean[5, 7] = True
+        for wrap in [True, False]:
+            downstream, level = priority_flood(elevation, ocean, wrap)
+            # the level of a cell is the lowest elevation the water has to
+            # get over to reach the ocean
+            expected = numpy.where(ocean, elevation, numpy.inf).T
+            changed = True
+            while changed:
+                changed = False
+                for x in range(12):
+                    for y in range(9):
+                        lowest = min(expected[nx % 12, ny % 9]
+                                     for nx, ny in [(x, y - 1), (x + 1, y),
+                                                    (x, y + 1), (x - 1, y)]
+                                     if wrap or (0 <= nx < 12 and
+                                                 0 <= ny < 9))
+                        value = max(elevation[y, x], lowest)
+                        if value < expected[x, y]:
+                            expected[x, y] = value
+                            changed = True
+            self.assertTrue(numpy.allclose(expected, level))
+            # following the spill routes the level never rises
+            for x in range(12):
+                for y in range(9):
+                    while downstream[x, y] >= 0:
+                        nx, ny = divmod(downstream[x, y], 9)
+                        self.assertTrue(level[nx, ny] <= level[x, y])
+                        x, y = nx, ny
+                    self.assertTrue(ocean[y, x])
+
+    def test_erosion_priority_flood_mode(self):
+        w = World.open_protobuf("%s/seed_28070.world" % self.tests_data_dir)
+        elevation = w.elevation['data'].copy()
+        erosion = ErosionSimulation()
+        erosion.priority_flood_mode = True
+        erosion.execute(w, w.seed)
+        _, level = priority_flood(elevation, w.ocean)
+        depth = (level - elevation.T).T
+        lakes = w.lake_map > 0
+        self.assertTrue(numpy.count_nonzero(w.river_map) > 0)
+        self.assertTrue(numpy.all(depth[lakes] > 0))
+        self.assertTrue(numpy.allclose(depth[lakes], w.lake_map[lakes]))
+
+    def test_find_thresholds(self):
+        numpy.random.seed(1)
+        data = numpy.random.uniform(-1.0, 1.0, (40, 50))
+        ocean = numpy.zeros((40, 50), dtype=bool)
+        ocean[:10, :] = True
+        land = data[10:, :]
+        percs = [0.9, 0.5, 0.25, 0.01]
+        ths = find_thresholds(data, percs, ocean)
+        for perc, th in zip(percs, ths):
+            self.assertEqual(int(round(land.size * perc)),
+                             numpy.count_nonzero(land > th))
+        self.assertEqual(sorted(ths), ths)
+        self.assertEqual(ths[1], find_threshold_f(data, 0.5, ocean))
+        self.assertRaises(Exception, find_thresholds, data, percs, ocean[1:])
+
+    def test_approximate_thresholds(self):
+        numpy.random.seed(2)
+        data = numpy.random.normal(0.0, 1.0, (300, 20))
+        ocean = data < -1.5
+        percs = [0.98, 0.75, 0.5, 0.1, 0.0]
+        exact = find_thresholds(data, percs, ocean)
+        error = 0.001
+        set_thresholds_error(error)
+        try:
+            approximated = find_thresholds(data, percs, ocean)
+        finally:
+            set_thresholds_error(None)
+        value_range = data[~ocean].max() - data[~ocean].min()
+        for e, a in zip(exact, approximated):
+            self.assertTrue(abs(e - a) <= error * value_range)
+        self.assertRaises(Exception, set_thresholds_error, 1.5)
+
+    def test_find_integer_thresholds(self):
+        data = numpy.arange(100).reshape((10, 10))
+        self.assertEqual([49, 89], find_integer_thresholds(data, [0.5, 0.1]))
+        self.assertEqual(89, find_threshold(data, 0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
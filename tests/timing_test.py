@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy
+
+import worldengine.timing
+from worldengine.a_star import PathFinder
+from worldengine.memory import rss_source
+from worldengine.timing import Recorder, add_listener, count, count_max, \
+    current_span, remove_listener, set_memory_sampling, set_profile, span, \
+    timed
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder()
+        add_listener(self.recorder)
+
+    def tearDown(self):
+        remove_listener(self.recorder)
+
+    def test_nested_spans(self):
+        with span('stage', verbose=False) as stage:
+            for i in range(3):
+                with span('step', index=i):
+                    self.assertEqual('step', current_span().name)
+            with span('other'):
+                pass
+        self.assertIsNone(current_span())
+        self.assertEqual(['step', 'step', 'step', 'other'],
+                         [s.name for s in stage.children])
+        self.assertTrue(all(s.parent is stage for s in stage.children))
+        self.assertEqual(2, stage.children[2].attributes['index'])
+        self.assertEqual([stage], self.recorder.roots())
+
+        summary = self.recorder.summary()
+        self.assertEqual(1, len(summary['spans']))
+        children = summary['spans'][0]['children']
+        self.assertEqual(['step', 'other'], [c['name'] for c in children])
+        self.assertEqual([3, 1], [c['count'] for c in children])
+        self.assertTrue(summary['seconds'] >= children[0]['seconds'])
+
+    def test_span_in_other_thread(self):
+        @timed
+        def work():
+            pass
+
+        def part():
+            with span('part', parent=stage):
+                pass
+
+        with span('stage', verbose=False) as stage:
+            thread = threading.Thread(target=part)
+            thread.start()
+            thread.join()
+            work()
+        # the spans of another thread do not change the current span
+        self.assertEqual(['part', 'work'], [s.name for s in stage.children])
+
+    def test_span_ends_on_error(self):
+        ended = []
+        add_listener(ended.append)
+        try:
+            with span('failing', verbose=False):
+                raise ValueError()
+        except ValueError:
+            pass
+        finally:
+            remove_listener(ended.append)
+        self.assertEqual(['failing'], [s.name for s in ended])
+        self.assertIsNone(current_span())
+
+    def test_counters(self):
+        # without a span the counters are not kept
+        count('ignored')
+        with span('stage', verbose=False) as stage:
+            for i in range(2):
+                with span('step'):
+                    count('visits', 3)
+                    count('visits')
+                    count_max('depth', 5 - i)
+                    count_max('depth', 2)
+            count('steps', 2)
+        self.assertEqual({'steps': 2}, stage.counters)
+        self.assertEqual({'visits': 4}, stage.children[1].counters)
+        self.assertEqual({'depth': 4}, stage.children[1].maxima)
+
+        summary = self.recorder.summary()['spans'][0]
+        self.assertEqual({'steps': 2}, summary['counters'])
+        self.assertEqual({'visits': 8, 'depth': 5},
+                         summary['children'][0]['counters'])
+        events = self.recorder.trace_events()
+        self.assertEqual({'visits': 4, 'depth': 5}, events[1]['args'])
+
+    def test_a_star_counters(self):
+        heightmap = [[1, 1, 1], [1, 9, 1], [1, 1, 1]]
+        with span('path', verbose=False) as s:
+            path = PathFinder().find(heightmap, [0, 0], [2, 2])
+        self.assertEqual([2, 2], path[-1])
+        self.assertTrue(s.counters['a_star.nodes_expanded'] > 0)
+        self.assertNotIn('a_star.bailouts', s.counters)
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(directory, 'w_1')
+            set_profile(['profiled', 'inner'], prefix)
+            with span('other', stage=True, verbose=False):
+                pass
+            with span('profiled', stage=False, verbose=False):
+                pass
+            self.assertEqual([], os.listdir(directory))
+            with span('profiled', stage=True, verbose=False):
+                # profiled as part of the outer stage
+                with span('inner', stage=True):
+                    sum(range(100))
+            self.assertEqual(['w_1_profiled.prof'], os.listdir(directory))
+            set_profile(['all'], prefix)
+            with span('other', stage=True, verbose=False):
+                pass
+            self.assertTrue(os.path.exists(prefix + '_other.prof'))
+        finally:
+            set_profile(None)
+            shutil.rmtree(directory)
+        self.assertRaises(Exception, set_profile, ['all'])
+
+    @unittest.skipIf(rss_source() is None, "memory cannot be measured")
+    def test_memory_sampling(self):
+        set_memory_sampling(0.001)
+        try:
+            with span('stage', stage=True, verbose=False) as s:
+                a = numpy.ones(4 * 1024 * 1024)
+                del a
+            with span('other', verbose=False) as other:
+                pass
+        finally:
+            set_memory_sampling(None)
+        self.assertTrue(s.maxima['memory.peak_rss'] > 0)
+        self.assertTrue(s.maxima['memory.peak_increase'] >= 0)
+        # only the stages are sampled
+        self.assertEqual({}, other.maxima)
+
+    @unittest.skipIf(rss_source() is None, "memory cannot be measured")
+    def test_memory_sampling_overlapping_stages(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def other_stage():
+            with span('other', parent=outer, stage=True):
+                started.set()
+                finish.wait()
+
+        set_memory_sampling(0.001)
+        try:
+            with span('outer', stage=True, verbose=False) as outer:
+                thread = threading.Thread(target=other_stage)
+                thread.start()
+                started.wait()
+                with span('inner', stage=True) as inner:
+                    finish.set()
+                thread.join()
+        finally:
+            set_memory_sampling(None)
+        other = outer.children[0]
+        # a stage does not overlap the stages enclosing it
+        self.assertNotIn('memory.overlapping', outer.attributes)
+        self.assertEqual(['other'], inner.attributes['memory.overlapping'])
+        self.assertEqual(['inner'], other.attributes['memory.overlapping'])
+        self.assertEqual(1, inner.maxima['memory.overlapping_stages'])
+
+    def test_memory_sampling_stops(self):
+        set_memory_sampling(0.001)
+        sampler = worldengine.timing.memory_sampler
+        set_memory_sampling(None)
+        self.assertIsNone(worldengine.timing.memory_sampler)
+        self.assertFalse(sampler._thread.is_alive())
+
+    def test_write(self):
+        with span('stage', verbose=False):
+            with span('step', seed=1):
+                pass
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'timings.json')
+            self.recorder.write_summary(filename, name='w')
+            with open(filename) as f:
+                summary = json.load(f)
+            self.assertEqual('w', summary['name'])
+            self.assertEqual('stage', summary['spans'][0]['name'])
+
+            filename = os.path.join(directory, 'trace.json')
+            self.recorder.write_trace(filename)
+            with open(filename) as f:
+                events = json.load(f)['traceEvents']
+            self.assertEqual(['stage', 'step'], [e['name'] for e in events])
+            self.assertEqual('X', events[0]['ph'])
+            self.assertEqual({'seed': 1}, events[1]['args'])
+            self.assertTrue(events[0]['dur'] >= events[1]['dur'])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import numpy
+from worldengine.world import *
+
+from tests.draw_test import TestBase
+
+
+class TestWorld(TestBase):
+
+    def setUp(self):
+        super(TestWorld, self).setUp()
+
+    def test_layer_dict_access(self):
+        l = Layer([[0.5, 1.5], [2.5, 3.5]], thresholds=[('low', 1.0)])
+        self.assertTrue(isinstance(l['data'], numpy.ndarray))
+        self.assertEqual((2, 2), l.shape)
+        self.assertEqual(1.5, l['data'][0][1])
+        self.assertEqual(2.5, l['data'][1, 0])
+        self.assertEqual([('low', 1.0)], l['thresholds'])
+        self.assertEqual(None, l['quantiles'])
+        self.assertRaises(KeyError, l.__getitem__, 'foo')
+
+        l['data'] = [[0, 0], [0, 1]]
+        self.assertEqual(numpy.float64, l['data'].dtype)
+
+    def test_layer_equality(self):
+        a = Layer([[0.5, 1.5]], quantiles={'12': 0.3})
+        b = Layer(numpy.array([[0.5, 1.5]]), quantiles={'12': 0.3})
+        c = Layer([[0.5, 1.6]], quantiles={'12': 0.3})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def test_setters_accept_lists_and_arrays(self):
+        w = World("Foo", 3, 2, 1, 10, 1.0, Step.full())
+        w.set_ocean([[True, False, False], [True, True, False]])
+        self.assertEqual(bool, w.ocean.dtype)
+        self.assertTrue(w.is_ocean((1, 1)))
+        self.assertTrue(w.is_land((1, 0)))
+        w.set_elevation(numpy.zeros((2, 3)), None)
+        self.assertEqual(0.0, w.elevation_at((2, 1)))
+        self.assertRaises(Exception, w.set_plates, [[0, 0], [0, 0]])
+
+    def test_biome_is_stored_as_indexes(self):
+        w = World("Foo", 2, 1, 1, 10, 1.0, Step.full())
+        w.set_biome([['ocean', 'ice']])
+        self.assertEqual(numpy.uint8, w.biome.dtype)
+        self.assertEqual(biome_name_to_index('ice'), w.biome[0][1])
+        self.assertTrue(isinstance(w.biome_at((1, 0)), Ice))
+        w.set_biome(numpy.array([[12, 13]]))
+        self.assertTrue(isinstance(w.biome_at((1, 0)), PolarDesert))
+        self.assertRaises(Exception, w.set_biome, [['ocean', 'foo']])
+
+    def test_class_maps_match_cell_predicates(self):
+        w = World.open_protobuf("%s/seed_28070.world" % self.tests_data_dir)
+        t = w.temperature_class_map()
+        h = w.humidity_class_map()
+        e = w.elevation_class_map()
+        self.assertEqual(numpy.int8, t.dtype)
+        for y in range(0, w.height, 7):
+            for x in range(0, w.width, 3):
+                pos = (x, y)
+                self.assertTrue(getattr(w, 'is_temperature_%s' % TEMPERATURE_CLASSES[t[y, x]])(pos))
+                self.assertTrue(getattr(w, 'is_humidity_%s' % HUMIDITY_CLASSES[h[y, x]])(pos))
+                self.assertEqual(w.is_ocean(pos), e[y, x] == 0)
+                self.assertEqual(w.is_hill(pos), e[y, x] == 2)
+                self.assertEqual(w.is_mountain(pos), e[y, x] == 3)
+
+    def test_class_maps_are_cached(self):
+        w = World.open_protobuf("%s/seed_28070.world" % self.tests_data_dir)
+        self.assertTrue(w.temperature_class_map() is w.temperature_class_map())
+        before = w.temperature_class_map()
+        w.set_temperature(w.temperature['data'] + 10.0, w.temperature['thresholds'])
+        self.assertFalse(before is w.temperature_class_map())
+        self.assertEqual(6, w.temperature_class_map().min())
+
+    def test_old_pickle_files_are_upgraded(self):
+        w = World.from_pickle_file("%s/plates_279.world" % self.tests_data_dir)
+        self.assertTrue(isinstance(w.elevation, Layer))
+        self.assertEqual((w.height, w.width), w.elevation['data'].shape)
+        self.assertEqual(numpy.uint16, w.plates.dtype)
+
+    def test_memory_report(self):
+        w = World("Foo", 3, 2, 1, 10, 1.0, Step.full())
+        w.set_ocean([[True, False, False], [True, True, False]])
+        w.set_elevation(numpy.zeros((2, 3)), [('sea', 0.5), ('plain', 1.0),
+                                              ('hill', 2.0),
+                                              ('mountain', None)])
+        w.set_plates(numpy.zeros((2, 3)))
+        self.assertEqual({'ocean': 6, 'elevation': 48, 'plates': 12},
+                         w.memory_report())
+        w.elevation_class_map()
+        self.assertEqual(6, w.memory_report()['class_maps'])
+
+
+if __name__ == '__main__':
+    unittest.main()
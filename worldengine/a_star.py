@@ -5,230 +5,143 @@ Part of the WorldEngine project.
 author:  Bret Curtis
 """
 
-
-class Path:
-
-    def __init__( self, nodes, totalCost ):
-        self.nodes = nodes
-        self.totalCost = totalCost
-
-    def getNodes( self ):
-        return self.nodes
-
-    def getTotalMoveCost( self ):
-        return self.totalCost
-
-
-class Node:
-
-    def __init__( self, location, mCost, lid, parent = None ):
-        self.location = location # where is this node located
-        self.mCost = mCost  # total move cost to reach this node
-        self.parent = parent # parent node
-        self.score = 0 # calculated score for this node
-        self.lid = lid # location id unique for each location in the map
-
-    def __eq__( self, n ):
-        if n.lid == self.lid:
-            return 1
-        else:
-            return 0
-
-
-class AStar:
-
-    def __init__( self, maphandler ):
-        self.mh = maphandler
-
-    def _getBestOpenNode( self ):
-        bestNode = None
-        for n in self.on:
-            if not bestNode:
-                bestNode = n
-            else:
-                if n.score <= bestNode.score:
-                    bestNode = n
-        return bestNode
-
-    def _tracePath( self, n ):
-        nodes = []
-        totalCost = n.mCost
-        p = n.parent
-        nodes.insert( 0, n )
-
-        while 1:
-            if p.parent is None:
-                break
-
-            nodes.insert( 0, p )
-            p = p.parent
-
-        return Path( nodes, totalCost )
-
-    def _handleNode( self, node, end ):
-        i = self.o.index( node.lid )
-        self.on.pop( i )
-        self.o.pop( i )
-        self.c.append( node.lid )
-
-        nodes = self.mh.getAdjacentNodes( node, end )
-
-        for n in nodes:
-            if n.location == end:
-                # reached the destination
-                return n
-            elif n.lid in self.c:
-                # already in close, skip this
-                continue
-            elif n.lid in self.o:
-                # already in open, check if better score
-                i = self.o.index( n.lid )
-                on = self.on[i]
-                if n.mCost < on.mCost:
-                    self.on.pop( i )
-                    self.o.pop( i )
-                    self.on.append( n )
-                    self.o.append( n.lid )
-            else:
-                # new node, append to open list
-                self.on.append( n )
-                self.o.append( n.lid )
-
-        return None
-
-    def findPath( self, fromlocation, tolocation ):
-        self.o = []
-        self.on = []
-        self.c = []
-
-        end = tolocation
-        fnode = self.mh.getNode( fromlocation )
-        if not fnode: # it is possible that fromLocation comes from mountain
-            return None
-        self.on.append( fnode )
-        self.o.append( fnode.lid )
-        nextNode = fnode
-
-        # need to build in a bail-out counter
-        counter = 0
-
-        while nextNode is not None:
-            if counter > 10000:
-                break # no path found under limit
-            finish = self._handleNode( nextNode, end )
-            if finish:
-                return self._tracePath( finish )
-            nextNode = self._getBestOpenNode()
-            counter += 1
-
-        return None
-
-
-class SQ_Location:
-    """A simple Square Map Location implementation"""
-
-    def __init__( self, x, y ):
-        self.x = x
-        self.y = y
-
-    def __eq__( self, l ):
-        if l.x == self.x and l.y == self.y:
-            return 1
-        else:
-            return 0
-
-
-class SQ_MapHandler:
-    """A simple Square Map implementation"""
-
-    def __init__( self, mapdata, width, height ):
-        self.m = mapdata
-        self.w = width
-        self.h = height
-
-    def getNode( self, location ):
-        x = location.x
-        y = location.y
-        if x < 0 or x >= self.w or y < 0 or y >= self.h:
-            return None
-        d = self.m[( y * self.w ) + x]
-
-#        import constants
-#        if d >= ( constants.BIOME_ELEVATION_MOUNTAIN ): # not over mountains
-#            return None
-
-        return Node( location, d, ( ( y * self.w ) + x ) )
-
-    def getAdjacentNodes( self, curnode, dest ):
-        result = []
-
-        cl = curnode.location
-        dl = dest
-
-        n = self._handleNode( cl.x + 1, cl.y, curnode, dl.x, dl.y )
-        if n: result.append( n )
-        n = self._handleNode( cl.x - 1, cl.y, curnode, dl.x, dl.y )
-        if n: result.append( n )
-        n = self._handleNode( cl.x, cl.y + 1, curnode, dl.x, dl.y )
-        if n: result.append( n )
-        n = self._handleNode( cl.x, cl.y - 1, curnode, dl.x, dl.y )
-        if n: result.append( n )
-
-        return result
-
-    def _handleNode( self, x, y, fromnode, destx, desty ):
-        n = self.getNode( SQ_Location( x, y ) )
-        if n is not None:
-            dx = max( x, destx ) - min( x, destx )
-            dy = max( y, desty ) - min( y, desty )
-            emCost = dx + dy
-            n.mCost += fromnode.mCost
-            n.score = n.mCost + emCost
-            n.parent = fromnode
-            #print dx,dy,emCost,fromnode.mCost,n.mCost,n.score
-            return n
-
-        return None
-
-
-def _matrix_to_array(matrix):
-    array = []
-    for row in matrix:
-        for cell in row:
-            array.append(cell)
-    return array
-
-
-class PathFinder:
-    """Using the a* algo we will try to find the best path between two
-       points"""
-
-    def __init__(self):
-        pass
-
-    def find( self, heightmap, source, destination ):
+import heapq
+
+import numpy
+
+from worldengine.timing import count
+
+# The search is abandoned after expanding this many cells
+MAX_EXPANSIONS = 10000
+
+
+class AStar(object):
+    """
+    A* search on a rectangular heightmap, indexed as [y][x], moving to the
+    4 neighbours of each cell. Entering a cell costs its elevation, so the
+    paths go through the lowest cells, and the cost left to the destination
+    is estimated by the Manhattan distance. When wrap is set the map wraps
+    around horizontally.
+
+    The heightmap is read through a flat array: when it is a contiguous
+    numpy array of floats this is a view of it, so changes made in place
+    between the searches are seen. The arrays of the search are allocated
+    once and reused: each search marks the cells it reaches with its own
+    number instead of clearing them.
+    """
+
+    def __init__(self, heightmap, wrap=False, max_expansions=MAX_EXPANSIONS):
+        self.heightmap = heightmap
+        elevation = numpy.asarray(heightmap, dtype=float)
+        self.height, self.width = elevation.shape
+        self.elevation = numpy.ravel(elevation)
+        self.shared = elevation is heightmap and \
+            elevation.flags.c_contiguous
+        self.wrap = wrap
+        self.max_expansions = max_expansions
+        size = self.width * self.height
+        self._search = 0
+        self._reached = [0] * size  # the last search reaching each cell
+        self._closed = [0] * size  # the last search expanding each cell
+        self._g = [0.0] * size  # the cost of the best path to each cell
+        self._parent = [0] * size
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def distance(self, x, y, dx, dy):
+        distance_x = abs(x - dx)
+        if self.wrap:
+            distance_x = min(distance_x, self.width - distance_x)
+        return distance_x + abs(y - dy)
+
+    def find(self, source, destination):
+        """Return the cells of the cheapest path from source to destination
+        as [x, y], the source excluded. The path is empty when there is
+        none or when it is not found within max_expansions."""
         sx, sy = source
         dx, dy = destination
+        if not (self.contains(sx, sy) and self.contains(dx, dy)) or \
+                (sx, sy) == (dx, dy):
+            return []
+        self._search += 1
+        search = self._search
+        reached, closed, g, parent = \
+            self._reached, self._closed, self._g, self._parent
+        elevation = self.elevation.item
+        width, height, wrap = self.width, self.height, self.wrap
+        start = sy * width + sx
+        end = dy * width + dx
+
+        reached[start] = search
+        g[start] = elevation(start)
+        # among the cells with the same score the last reached is expanded
+        # first, the order is its second element
+        open_cells = [(g[start] + self.distance(sx, sy, dx, dy), 0, start)]
+        order = 0
+        expanded = 0
+        while open_cells:
+            cell = heapq.heappop(open_cells)[2]
+            if closed[cell] == search:
+                # a worse entry of a cell reached again
+                continue
+            if expanded > self.max_expansions:
+                count('a_star.bailouts')
+                break
+            closed[cell] = search
+            expanded += 1
+            y, x = divmod(cell, width)
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if wrap:
+                    nx %= width
+                elif nx < 0 or nx >= width:
+                    continue
+                if ny < 0 or ny >= height:
+                    continue
+                n = ny * width + nx
+                if n == end:
+                    parent[n] = cell
+                    count('a_star.nodes_expanded', expanded)
+                    return self._trace(start, end)
+                if closed[n] == search:
+                    continue
+                cost = g[cell] + elevation(n)
+                if reached[n] == search and cost >= g[n]:
+                    continue
+                reached[n] = search
+                g[n] = cost
+                parent[n] = cell
+                order -= 1
+                heapq.heappush(open_cells,
+                               (cost + self.distance(nx, ny, dx, dy),
+                                order, n))
+
+        count('a_star.nodes_expanded', expanded)
+        return []
+
+    def _trace(self, start, end):
         path = []
-        dim = len( heightmap )
-
-        # flatten array
-        graph = _matrix_to_array(heightmap)
-
-        pathFinder = AStar( SQ_MapHandler( graph, dim, dim ) )
-        start = SQ_Location( sx, sy )
-        end = SQ_Location( dx, dy )
+        cell = end
+        while cell != start:
+            y, x = divmod(cell, self.width)
+            path.append([x, y])
+            cell = self._parent[cell]
+        path.reverse()
+        return path
 
-        #from time import time
-        #s = time()
-        p = pathFinder.findPath( start, end )
-        #e = time()
 
-        if not p:
-            return path
-
-        #print "      Found path in %d moves and %f seconds." % (len(p.nodes), (e-s))
-        for node in p.nodes:
-            path.append( [node.location.x, node.location.y] )
-
-        return path
\ No newline at end of file
+class PathFinder(object):
+    """Using the a* algo we will try to find the best path between two
+       points. The search is reused while the same heightmap is given, if
+       it is a numpy array (see AStar)."""
+
+    def __init__(self, wrap=False):
+        self.wrap = wrap
+        self._astar = None
+
+    def find(self, heightmap, source, destination):
+        astar = self._astar
+        if astar is None or astar.heightmap is not heightmap or \
+                not astar.shared:
+            astar = self._astar = AStar(heightmap, self.wrap)
+        return astar.find(source, destination)
@@ -2,8 +2,8 @@ import math
 import random
 
 
-def random_point(width, height):
-    return random.randrange(0, width), random.randrange(0, height)
+def random_point(width, height, rng=random):
+    return rng.randrange(0, width), rng.randrange(0, height)
 
 
 def distance(pa, pb):
@@ -210,18 +210,29 @@ class TropicalRainForest(Biome):
 # Serialization
 # -------------
 
+# Biome names are looked up once per cell when converting or drawing a
+# whole map, so the sorted names and their indexes are calculated only once
+_sorted_names = []
+_indexes_by_name = {}
+
+
+def _sorted_biome_names():
+    global _sorted_names, _indexes_by_name
+    if len(_sorted_names) != len(_BiomeMetaclass.biomes):
+        _sorted_names = sorted(_BiomeMetaclass.biomes.keys())
+        _indexes_by_name = dict((n, i) for i, n in enumerate(_sorted_names))
+    return _sorted_names
+
+
 def biome_name_to_index(biome_name):
-    names = _BiomeMetaclass.biomes.keys()
-    names.sort()
-    for i in range(len(names)):
-        if names[i] == biome_name:
-            return i
-    raise Exception("Not found")
+    _sorted_biome_names()
+    if biome_name not in _indexes_by_name:
+        raise Exception("Not found")
+    return _indexes_by_name[biome_name]
 
 
 def biome_index_to_name(biome_index):
-    names = _BiomeMetaclass.biomes.keys()
-    names.sort()
+    names = _sorted_biome_names()
     if biome_index < 0 or biome_index >= len(names):
         raise Exception("Not found")
     return names[biome_index]
@@ -0,0 +1,82 @@
+"""
+Checkpoints of the generation of a world: the world is saved after each
+stage of the generation, so that it can be resumed from the last stage
+completed.
+
+The world is saved as a pickle file, because it has to keep also the
+incomplete layers of the early stages. A JSON file next to it records the
+stage and the parameters of the generation.
+"""
+
+import json
+import os
+import pickle
+import tempfile
+
+from worldengine.common import replace_file
+
+
+def _checkpoint_files(directory, world_name):
+    base = os.path.join(directory, world_name)
+    return base + '.checkpoint', base + '.checkpoint.json'
+
+
+def _parameters(world):
+    return {'name': world.name, 'width': world.width,
+            'height': world.height, 'seed': world.seed,
+            'n_plates': world.n_plates, 'ocean_level': world.ocean_level,
+            'step': world.step.name}
+
+
+def _write_atomically(path, content):
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    replace_file(tmp_path, path)
+
+
+def save_checkpoint(directory, world, stage):
+    """Save the world, as it is after the given stage. Nothing is saved
+    when directory is None"""
+    if directory is None:
+        return
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    world_file, info_file = _checkpoint_files(directory, world.name)
+    _write_atomically(world_file,
+                      pickle.dumps(world, pickle.HIGHEST_PROTOCOL))
+    info = {'stage': stage, 'parameters': _parameters(world)}
+    _write_atomically(info_file, json.dumps(info, indent=2,
+                                            sort_keys=True).encode('utf-8'))
+
+
+def checkpoint_stage(directory, world_name):
+    """Return the last stage saved for the world, or None"""
+    world_file, info_file = _checkpoint_files(directory, world_name)
+    if not os.path.exists(info_file) or not os.path.exists(world_file):
+        return None
+    with open(info_file, 'r') as f:
+        return json.load(f)['stage']
+
+
+def load_checkpoint(directory, world_name, width, height, seed, n_plates,
+                    ocean_level, step):
+    """Load the last checkpoint of the world, or return None when there is
+    not one. The checkpoint has to be produced with the same parameters."""
+    if checkpoint_stage(directory, world_name) is None:
+        return None
+    world_file, info_file = _checkpoint_files(directory, world_name)
+    with open(world_file, 'rb') as f:
+        world = pickle.load(f)
+    expected = {'name': world_name, 'width': width, 'height': height,
+                'seed': seed, 'n_plates': n_plates,
+                'ocean_level': ocean_level, 'step': step.name}
+    actual = _parameters(world)
+    different = sorted(k for k in expected if expected[k] != actual[k])
+    if different:
+        raise Exception(
+            "The checkpoint of %s was generated with different parameters: "
+            % world_name + ", ".join("%s %s instead of %s" % (
+                k, actual[k], expected[k]) for k in different))
+    return world
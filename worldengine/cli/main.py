@@ -11,6 +11,13 @@ from worldengine.drawing_functions import *
 from worldengine.world import *
 from worldengine.common import *
 from worldengine.step import Step
+from worldengine.simulations.basic import set_thresholds_error
+from worldengine.simulations.ErosionSimulation import \
+    set_priority_flood_mode
+from worldengine.memory import rss_source
+from worldengine.noise_field import set_noise_cache
+from worldengine.timing import Recorder, add_listener, remove_listener, \
+    set_profile, set_memory_sampling
 from worldengine.version import __version__
 
 VERSION = __version__
@@ -21,9 +28,11 @@ STEPS = 'plates|precipitations|full'
 
 
 def generate_world(world_name, width, height, seed, num_plates, output_dir,
-                   step, ocean_level, world_format='pickle', verbose=True):
+                   step, ocean_level, world_format='pickle', verbose=True,
+                   checkpoint_dir=None, resume=False):
     w = world_gen(world_name, width, height, seed, num_plates, ocean_level,
-                  step, verbose=verbose)
+                  step, verbose=verbose, checkpoint_dir=checkpoint_dir,
+                  resume=resume)
 
     print('')  # empty line
     print('Producing ouput:')
@@ -251,6 +260,26 @@ def main():
                       metavar="N", default='2000')
     parser.add_option('-v', '--verbose', dest='verbose', action="store_true",
                       help="Enable verbose messages", default=False)
+    parser.add_option('--trace', dest='trace',
+                      help="write in FILE the time spent in each stage, in " +
+                           "the Chrome trace-event format",
+                      metavar="FILE")
+    parser.add_option('--memory-sampling', dest='memory_sampling',
+                      action="store_true",
+                      help="record in the timings the peak of the memory " +
+                           "used by each stage, sampling it every 10 ms. " +
+                           "It is the memory of the whole process: with " +
+                           "more workers the stages executed at the same " +
+                           "time share their peaks",
+                      default=False)
+    parser.add_option('--profile-stage', dest='profile_stages',
+                      help="profile the STAGES (comma separated names, as " +
+                           "in the timings, or 'all') with cProfile, " +
+                           "writing a .prof file for each one in the " +
+                           "output dir. It can be set also through the " +
+                           "WORLDENGINE_PROFILE environment variable",
+                      metavar="STAGES",
+                      default=os.environ.get('WORLDENGINE_PROFILE'))
 
     # -----------------------------------------------------
     g_generate = OptionGroup(parser, "Generate Options",
@@ -266,6 +295,38 @@ def main():
                           help='elevation cut off for sea level [default = ' +
                                '%default]',
                           metavar="N", default=1.0)
+    g_generate.add_option('--thresholds-error', dest='thresholds_error',
+                          type="float",
+                          help='approximate the thresholds of the layers ' +
+                               'with an error of at most E times the range ' +
+                               'of their values, using less memory. By ' +
+                               'default thresholds are calculated exactly',
+                          metavar="E")
+    g_generate.add_option('--noise-cache', dest='noise_cache',
+                          help='cache the noise maps in DIR, to reuse them ' +
+                               'when a seed is used again',
+                          metavar="DIR")
+    g_generate.add_option('--noise-cache-size', dest='noise_cache_size',
+                          type="int",
+                          help='maximum size of the noise cache, in MB ' +
+                               '[default = %default]',
+                          metavar="N", default=256)
+    g_generate.add_option('--checkpoint-dir', dest='checkpoint_dir',
+                          help='save the world in DIR after each stage of ' +
+                               'the generation',
+                          metavar="DIR")
+    g_generate.add_option('--resume', dest='resume', action="store_true",
+                          help='resume the generation from the last stage ' +
+                               'saved in the checkpoint dir', default=False)
+    g_generate.add_option('--priority-flood', dest='priority_flood',
+                          action="store_true",
+                          help='fill the depressions of the map to trace ' +
+                               'the rivers and find the lakes',
+                          default=False)
+    g_generate.add_option('--workers', dest='workers', type="int",
+                          help='number of threads used to calculate the ' +
+                               'layers [default = %default]',
+                          metavar="N", default=1)
     parser.add_option_group(g_generate)
 
     # -----------------------------------------------------
@@ -346,6 +407,9 @@ def main():
     if options.rivers_map and not generation_operation:
         usage(error="Rivers map can be produced only during world generation")
 
+    if options.resume and not options.checkpoint_dir:
+        usage(error="Resuming requires a checkpoint dir (--checkpoint-dir)")
+
     print('Worldengine - a world generator (v. %s)' % VERSION)
     print('-----------------------')
     print(' operation         : %s generation' % operation)
@@ -375,45 +439,102 @@ def main():
     print('starting (it could take a few minutes) ...')
 
     set_verbose(options.verbose)
+    if options.workers < 1:
+        usage(error="Number of workers should be at least 1")
+    set_workers(options.workers)
+    set_priority_flood_mode(options.priority_flood)
+    if options.thresholds_error is not None:
+        if not 0.0 < options.thresholds_error < 1.0:
+            usage(error="Thresholds error should be in (0, 1)")
+        set_thresholds_error(options.thresholds_error)
+    if options.noise_cache:
+        if options.noise_cache_size <= 0:
+            usage(error="Noise cache size should be positive")
+        set_noise_cache(options.noise_cache,
+                        options.noise_cache_size * 1024 * 1024)
+
+    if options.profile_stages:
+        set_profile(options.profile_stages.split(','),
+                    os.path.join(options.output_dir,
+                                 "%s_%i" % (world_name, seed)))
+
+    if options.memory_sampling:
+        source = rss_source()
+        if source is None:
+            print("Warning: the memory used cannot be measured on this " +
+                  "platform, it will not be recorded")
+        elif source == 'peak':
+            print("Warning: only the peak of the memory used by the whole " +
+                  "process can be measured on this platform, the increase " +
+                  "of a stage is 0 once a higher peak has been reached")
+        if options.workers > 1:
+            print("Warning: the stages executed at the same time share " +
+                  "their peaks of memory, see memory.overlapping_stages. " +
+                  "Use --workers 1 to measure each of them")
+        set_memory_sampling(0.01)
+
+    recorder = Recorder()
+    add_listener(recorder)
 
-    if operation == 'world':
-        world = generate_world(world_name, options.width, options.height,
-                               seed, number_of_plates, options.output_dir,
-                               step, options.ocean_level, world_format,
-                               options.verbose)
-        if produce_grayscale_heightmap:
-            generate_grayscale_heightmap(world, produce_grayscale_heightmap)
-        if options.rivers_map:
-            generate_rivers_map(world, options.rivers_map)
-
-    elif operation == 'plates':
-        generate_plates(seed, world_name, options.output_dir, options.width,
-                        options.height, num_plates=number_of_plates)
-
-    elif operation == 'ancient_map':
-        # First, some error checking
-        if options.sea_color == "blue":
-            sea_color = (142, 162, 179, 255)
-        elif options.sea_color == "brown":
-            sea_color = (212, 198, 169, 255)
+    try:
+        if operation == 'world':
+            world = generate_world(world_name, options.width, options.height,
+                                   seed, number_of_plates, options.output_dir,
+                                   step, options.ocean_level, world_format,
+                                   options.verbose,
+                                   checkpoint_dir=options.checkpoint_dir,
+                                   resume=options.resume)
+            if produce_grayscale_heightmap:
+                generate_grayscale_heightmap(world,
+                                             produce_grayscale_heightmap)
+            if options.rivers_map:
+                generate_rivers_map(world, options.rivers_map)
+
+        elif operation == 'plates':
+            generate_plates(seed, world_name, options.output_dir,
+                            options.width, options.height,
+                            num_plates=number_of_plates)
+
+        elif operation == 'ancient_map':
+            # First, some error checking
+            if options.sea_color == "blue":
+                sea_color = (142, 162, 179, 255)
+            elif options.sea_color == "brown":
+                sea_color = (212, 198, 169, 255)
+            else:
+                usage("Unknown sea color: " + args[
+                    0] + "  Select from [" + SEA_COLORS + "]")
+            if not options.world_file:
+                usage(
+                    "For generating an ancient map is necessary to specify " +
+                    "the world to be used (-w option)")
+            world = load_world(options.world_file)
+
+            print_verbose(" * world loaded")
+
+            if not options.generated_file:
+                options.generated_file = "ancient_map_%s.png" % world.name
+            operation_ancient_map(world, options.generated_file,
+                                  options.resize_factor, sea_color)
         else:
-            usage("Unknown sea color: " + args[
-                0] + "  Select from [" + SEA_COLORS + "]")
-        if not options.world_file:
-            usage(
-                "For generating an ancient map is necessary to specify the " +
-                "world to be used (-w option)")
-        world = load_world(options.world_file)
-
-        print_verbose(" * world loaded")
-
-        if not options.generated_file:
-            options.generated_file = "ancient_map_%s.png" % world.name
-        operation_ancient_map(world, options.generated_file,
-                              options.resize_factor, sea_color)
-    else:
-        raise Exception(
-            'Unknown operation: valid operations are %s' % OPERATIONS)
+            raise Exception(
+                'Unknown operation: valid operations are %s' % OPERATIONS)
+
+        if operation == 'world':
+            filename = '%s/%s_timings.json' % (options.output_dir, world_name)
+            recorder.write_summary(filename, name=world_name, seed=seed,
+                                   width=options.width, height=options.height,
+                                   plates=number_of_plates,
+                                   workers=options.workers,
+                                   layers_memory=world.memory_report())
+            print("* timings saved in '%s'" % filename)
+        if options.trace:
+            recorder.write_trace(options.trace)
+            print("* trace saved in '%s'" % options.trace)
+    finally:
+        remove_listener(recorder)
+        # stop the sampling thread, before the interpreter shuts down
+        set_memory_sampling(None)
 
     print('...done')
 
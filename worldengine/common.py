@@ -1,6 +1,9 @@
 import math
+import os
 import sys
-import copy
+import numpy
+import threading
+from multiprocessing.pool import ThreadPool
 
 # ----------------
 # Global variables
@@ -8,6 +11,10 @@ import copy
 
 
 verbose = False
+# Number of threads used to calculate layers one band of rows at a time
+workers = 1
+_pool = None
+_pool_lock = threading.Lock()
 
 
 # -------
@@ -36,6 +43,44 @@ def print_verbose(msg):
         print(msg)
 
 
+def get_workers():
+    return workers
+
+
+def set_workers(value):
+    """
+    Set the number of threads used to calculate the layers which are
+    calculated cell by cell, one band of rows for each thread
+    """
+    global workers, _pool
+    if value < 1:
+        raise Exception("The number of workers should be at least 1")
+    if value != workers and _pool is not None:
+        _pool.close()
+        _pool = None
+    workers = value
+
+
+def for_each_band(height, calculate):
+    """
+    Call calculate(y_start, y_end) for horizontal bands of rows covering
+    height rows. When more workers are set the bands are calculated in
+    parallel: calculate should write its own rows of a shared result, using
+    numpy operations which release the GIL.
+    """
+    global _pool
+    n = min(get_workers(), height)
+    if n <= 1:
+        calculate(0, height)
+        return
+    with _pool_lock:
+        # simulations executed at the same time share the pool
+        if _pool is None:
+            _pool = ThreadPool(get_workers())
+    bounds = [height * i // n for i in range(n + 1)]
+    _pool.map(lambda i: calculate(bounds[i], bounds[i + 1]), range(n))
+
+
 class Counter(object):
 
     def __init__(self):
@@ -82,37 +127,62 @@ def rescale_value(original, prev_min, prev_max, min, max):
     return min + ((max - min) * f)
 
 
-def antialias(elevation, steps):
+def antialias(elevation, steps, closed_form=False):
     """
-    Execute the antialias operation steps times on the given elevation map
+    Execute the antialias operation steps times on the given elevation map.
+
+    At each step a cell gets the average of its original value, with weight
+    2, and of the values of the 3x3 cells around it, wrapping around the
+    borders of the map. With closed_form all the steps are applied at once
+    in the frequency domain, so that the cost does not depend on the number
+    of steps: the result differs only by rounding errors.
     """
-    width = len(elevation[0])
-    height = len(elevation)
-
-    def _antialias_step(original):
-        antialiased = copy.deepcopy(original)
-        for y in range(height):
-            for x in range(width):
-                antialiased[y][x] = antialias_point(original, x, y)
-        return antialiased
-
-    def antialias_point(original, x, y):
-        n = 2
-        tot = elevation[y][x] * 2
-        for dy in range(-1, +2):
-            py = (y + dy) % height
-            for dx in range(-1, +2):
-                px = (x + dx) % width
-                n += 1
-                tot += original[py][px]
-        return tot / n
-
-    current = elevation
+    elevation = numpy.asarray(elevation, dtype=numpy.float64)
+    if closed_form:
+        return _antialias_closed_form(elevation, steps)
+
+    height, width = elevation.shape
+    twice_elevation = elevation * 2
+    current = elevation.copy()
+    # buffers reused at each step: the map with a border of wrapped cells,
+    # and the sums of 3 cells on each row
+    padded = numpy.empty((height + 2, width + 2))
+    row_sums = numpy.empty((height + 2, width))
     for i in range(steps):
-        current = _antialias_step(current)
+        padded[1:-1, 1:-1] = current
+        padded[0, 1:-1] = current[-1]
+        padded[-1, 1:-1] = current[0]
+        padded[:, 0] = padded[:, -2]
+        padded[:, -1] = padded[:, 1]
+
+        numpy.add(padded[:, :-2], padded[:, 1:-1], out=row_sums)
+        row_sums += padded[:, 2:]
+        numpy.add(row_sums[:-2], row_sums[1:-1], out=current)
+        current += row_sums[2:]
+        current += twice_elevation
+        current /= 11
     return current
 
 
+def _antialias_closed_form(elevation, steps):
+    """
+    The antialias steps are linear: c(k + 1) = (2 e + B c(k)) / 11, where B
+    sums the 3x3 cells around each cell. In the frequency domain B
+    multiplies each frequency by b, so after n steps
+        c = (a^n + 2 / 11 (1 - a^n) / (1 - a)) e
+    with a = b / 11.
+    """
+    height, width = elevation.shape
+    b_y = 1 + 2 * numpy.cos(2 * numpy.pi * numpy.arange(height) / height)
+    b_x = 1 + 2 * numpy.cos(2 * numpy.pi * numpy.arange(width // 2 + 1) /
+                            width)
+    a = numpy.outer(b_y, b_x) / 11
+    a_n = a ** steps
+    kernel = a_n + (2.0 / 11) * (1 - a_n) / (1 - a)
+    return numpy.fft.irfft2(numpy.fft.rfft2(elevation) * kernel,
+                            s=elevation.shape)
+
+
 def array_to_matrix(array, width, height):
     if len(array) != (width * height):
         raise Exception("Array as not expected length")
@@ -122,3 +192,12 @@ def array_to_matrix(array, width, height):
         for x in xrange(width):
             matrix[y].append(array[y * width + x])
     return matrix
+
+
+def replace_file(source, destination):
+    """Rename source to destination, replacing destination if it exists.
+    On Windows os.rename does not replace an existing file, so it is
+    removed first."""
+    if os.name == 'nt' and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
@@ -1,7 +1,9 @@
 from PIL import Image
 
 from worldengine.drawing_functions import *
+from worldengine.biome import biome_index_to_name
 from worldengine.common import *
+from worldengine.timing import timed
 
 # -------------
 # Helper values
@@ -50,6 +52,29 @@ _biome_colors = {
     'tropical very dry forest': (160, 255, 128),
 }
 
+# colors of the classes listed in HUMIDITY_CLASSES
+_humidity_colors = [
+    (0, 32, 32, 255),
+    (0, 64, 64, 255),
+    (0, 96, 96, 255),
+    (0, 128, 128, 255),
+    (0, 160, 160, 255),
+    (0, 192, 192, 255),
+    (0, 224, 224, 255),
+    (0, 255, 255, 255)
+]
+
+# colors of the classes listed in TEMPERATURE_CLASSES
+_temperature_colors = [
+    (0, 0, 255, 255),
+    (42, 0, 213, 255),
+    (85, 0, 170, 255),
+    (128, 0, 128, 255),
+    (170, 0, 85, 255),
+    (213, 0, 42, 255),
+    (255, 0, 0, 255)
+]
+
 # ----------------
 # Helper functions
 # ----------------
@@ -265,24 +290,11 @@ def draw_precipitation(world, target):
     width = world.width
     height = world.height
 
+    humidity_classes = world.humidity_class_map().tolist()
+
     for y in range(height):
         for x in range(width):
-            if world.is_humidity_superarid((x, y)):
-                target.set_pixel(x, y, (0, 32, 32, 255))
-            elif world.is_humidity_perarid((x, y)):
-                target.set_pixel(x, y, (0, 64, 64, 255))
-            elif world.is_humidity_arid((x, y)):
-                target.set_pixel(x, y, (0, 96, 96, 255))
-            elif world.is_humidity_semiarid((x, y)):
-                target.set_pixel(x, y, (0, 128, 128, 255))
-            elif world.is_humidity_subhumid((x, y)):
-                target.set_pixel(x, y, (0, 160, 160, 255))
-            elif world.is_humidity_humid((x, y)):
-                target.set_pixel(x, y, (0, 192, 192, 255))
-            elif world.is_humidity_perhumid((x, y)):
-                target.set_pixel(x, y, (0, 224, 224, 255))
-            elif world.is_humidity_superhumid((x, y)):
-                target.set_pixel(x, y, (0, 255, 255, 255))
+            target.set_pixel(x, y, _humidity_colors[humidity_classes[y][x]])
 
 
 def draw_world(world, target):
@@ -303,22 +315,12 @@ def draw_temperature_levels(world, target):
     width = world.width
     height = world.height
 
+    temperature_classes = world.temperature_class_map().tolist()
+
     for y in range(height):
         for x in range(width):
-            if world.is_temperature_polar((x, y)):
-                target.set_pixel(x, y, (0, 0, 255, 255))
-            elif world.is_temperature_alpine((x, y)):
-                target.set_pixel(x, y, (42, 0, 213, 255))
-            elif world.is_temperature_boreal((x, y)):
-                target.set_pixel(x, y, (85, 0, 170, 255))
-            elif world.is_temperature_cool((x, y)):
-                target.set_pixel(x, y, (128, 0, 128, 255))
-            elif world.is_temperature_warm((x, y)):
-                target.set_pixel(x, y, (170, 0, 85, 255))
-            elif world.is_temperature_subtropical((x, y)):
-                target.set_pixel(x, y, (213, 0, 42, 255))
-            elif world.is_temperature_tropical((x, y)):
-                target.set_pixel(x, y, (255, 0, 0, 255))
+            target.set_pixel(x, y,
+                             _temperature_colors[temperature_classes[y][x]])
 
 
 def draw_biome(world, target):
@@ -326,11 +328,14 @@ def draw_biome(world, target):
     height = world.height
 
     biome = world.biome
+    colors = {}
 
     for y in range(height):
         for x in range(width):
-            v = biome[y][x]
-            target.set_pixel(x, y, _biome_colors[v])
+            v = biome[y, x]
+            if v not in colors:
+                colors[v] = _biome_colors[biome_index_to_name(v)]
+            target.set_pixel(x, y, colors[v])
 
 
 # -------------
@@ -338,30 +343,35 @@ def draw_biome(world, target):
 # -------------
 
 
+@timed
 def draw_simple_elevation_on_file(data, filename, width, height, sea_level):
     img = ImagePixelSetter(width, height, filename)
     draw_simple_elevation(data, width, height, sea_level, img)
     img.complete()
 
 
+@timed
 def draw_riversmap_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_riversmap(world, img)
     img.complete()
 
 
+@timed
 def draw_grayscale_heightmap_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_grayscale_heightmap(world, img)
     img.complete()
 
 
+@timed
 def draw_elevation_on_file(world, filename, shadow=True):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_elevation(world, shadow, img)
     img.complete()
 
 
+@timed
 def draw_ocean_on_file(ocean, filename):
     width = len(ocean[0])
     height = len(ocean)
@@ -370,30 +380,35 @@ def draw_ocean_on_file(ocean, filename):
     img.complete()
 
 
+@timed
 def draw_precipitation_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_precipitation(world, img)
     img.complete()
 
 
+@timed
 def draw_world_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_world(world, img)
     img.complete()
 
 
+@timed
 def draw_temperature_levels_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_temperature_levels(world, img)
     img.complete()
 
 
+@timed
 def draw_biome_on_file(world, filename):
     img = ImagePixelSetter(world.width, world.height, filename)
     draw_biome(world, img)
     img.complete()
 
 
+@timed
 def draw_ancientmap_on_file(world, filename, resize_factor=1,
                             sea_color=(212, 198, 169, 255), verbose=False):
     img = ImagePixelSetter(world.width * resize_factor,
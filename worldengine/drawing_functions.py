@@ -6,9 +6,10 @@ Jython
 
 import random
 import math
-import sys
-import time
+import numpy
 from worldengine.common import *
+from worldengine.timing import span
+from worldengine.world import ELEVATION_CLASSES
 
 
 # -------------------
@@ -109,17 +110,23 @@ def _find_land_borders(world, factor):
 
 
 def _find_mountains_mask(world, factor):
-    _mask = [[False for x in range(factor * world.width)] for y in
-             range(factor * world.height)]
-    for y in range(factor * world.height):
-        for x in range(factor * world.width):
-            if world.is_mountain((int(x / factor), int(y / factor))):
-                v = len(world.tiles_around((int(x / factor), int(y / factor)),
-                                           radius=3,
-                                           predicate=world.is_mountain))
-                if v > 32:
-                    _mask[y][x] = v / 4
-    return _mask
+    mountains = world.elevation_class_map() == \
+        ELEVATION_CLASSES.index('mountain')
+
+    # count the mountains in the 7x7 square around each cell, excluding the
+    # cell itself and the cells outside the map
+    radius = 3
+    height, width = mountains.shape
+    padded = numpy.zeros((height + 2 * radius, width + 2 * radius), dtype=int)
+    padded[radius:radius + height, radius:radius + width] = mountains
+    around = -mountains.astype(int)
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            around += padded[dy:dy + height, dx:dx + width]
+
+    _mask = numpy.where(mountains & (around > 32), around // 4, 0)
+    _mask = _mask.repeat(factor, axis=0).repeat(factor, axis=1)
+    return _mask.tolist()
 
 
 def _mask(world, predicate, factor):
@@ -526,202 +533,169 @@ def _pseudo_random_land_pos(world, i):
 
 def draw_ancientmap(world, target, resize_factor=1,
                     sea_color=(212, 198, 169, 255), verbose=get_verbose()):
-    random.seed(world.seed * 11)
-
-    if verbose:
-        start_time = time.time()
-
-    land_color = (
-        181, 166, 127, 255)  # TODO: Put this in the argument list too??
-    borders = _find_land_borders(world, resize_factor)
-    mountains_mask = _find_mountains_mask(world, resize_factor)
-    boreal_forest_mask = _find_boreal_forest_mask(world, resize_factor)
-    temperate_forest_mask = _find_temperate_forest_mask(world, resize_factor)
-    warm_temperate_forest_mask = \
-        _find_warm_temperate_forest_mask(world, resize_factor)
-    tropical_dry_forest_mask = _find_tropical_dry_forest_mask(world,
-                                                              resize_factor)
-    # jungle is actually Tropical Rain Forest and Tropical Seasonal Forest
-    jungle_mask = _mask(world, world.is_jungle,
-                        resize_factor)
-    tundra_mask = _mask(world, world.is_tundra, resize_factor)
-    # savanna is actually Tropical semi-arid
-    savanna_mask = _mask(world, world.is_savanna, resize_factor)
-    cold_parklands_mask = _mask(world, world.is_cold_parklands, resize_factor)
-    steppe_mask = _mask(world, world.is_steppe, resize_factor)
-    cool_desert_mask = _mask(world, world.is_cool_desert, resize_factor)
-    chaparral_mask = _mask(world, world.is_chaparral, resize_factor)
-    hot_desert_mask = _mask(world, world.is_hot_desert, resize_factor)
-
-    def unset_mask(pos):
-        x, y = pos
-        mountains_mask[y][x] = False
-
-    def unset_boreal_forest_mask(pos):
-        x, y = pos
-        boreal_forest_mask[y][x] = False
-
-    def unset_temperate_forest_mask(pos):
-        x, y = pos
-        temperate_forest_mask[y][x] = False
-
-    def unset_warm_temperate_forest_mask(pos):
-        x, y = pos
-        warm_temperate_forest_mask[y][x] = False
-
-    def unset_tropical_dry_forest_mask(pos):
-        x, y = pos
-        tropical_dry_forest_mask[y][x] = False
-
-    def unset_jungle_mask(pos):
-        x, y = pos
-        jungle_mask[y][x] = False
-
-    def unset_tundra_mask(pos):
-        x, y = pos
-        tundra_mask[y][x] = False
-
-    def unset_savanna_mask(pos):
-        x, y = pos
-        savanna_mask[y][x] = False
+    with span('draw_ancientmap', verbose=verbose, stage=True):
+        _draw_ancientmap(world, target, resize_factor, sea_color)
 
-    def unset_hot_desert_mask(pos):
-        x, y = pos
-        hot_desert_mask[y][x] = False
-
-    def unset_rock_desert_mask(pos):
-        x, y = pos
-        rock_desert_mask[y][x] = False
-
-    def unset_cold_parklands_mask(pos):
-        x, y = pos
-        cold_parklands_mask[y][x] = False
-
-    def unset_steppe_mask(pos):
-        x, y = pos
-        steppe_mask[y][x] = False
-
-    def unset_cool_desert_mask(pos):
-        x, y = pos
-        cool_desert_mask[y][x] = False
 
-    def unset_chaparral_mask(pos):
-        x, y = pos
-        chaparral_mask[y][x] = False
+def _draw_ancientmap(world, target, resize_factor, sea_color):
+    random.seed(world.seed * 11)
 
-    def on_border(pos):
-        x, y = pos
-        return borders[y][x]
-
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: init Elapsed time " +
-            str(elapsed_time) + " seconds.")
-        sys.stdout.flush()
-
-    if verbose:
-        start_time = time.time()
-    min_elev = None
-    max_elev = None
-    for y in range(world.height):
-        for x in range(world.width):
-            e = world.elevation['data'][y][x]
-            if min_elev is None or e < min_elev:
-                min_elev = e
-            if max_elev is None or e > max_elev:
-                max_elev = e
-    elev_delta = max_elev - min_elev
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: max, min elevation " +
-            "Elapsed time " + str(elapsed_time) + "  seconds.")
-
-    if verbose:
-        start_time = time.time()
-    for y in range(resize_factor * world.height):
-        for x in range(resize_factor * world.width):
-            xf = int(x / resize_factor)
-            yf = int(y / resize_factor)
-            if borders[y][x]:
-                target.set_pixel(x, y, (0, 0, 0, 255))
-            elif world.ocean[yf][xf]:
-                target.set_pixel(x, y, sea_color)
-            else:
-                target.set_pixel(x, y, land_color)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: color ocean " +
-            "Elapsed time " + str(elapsed_time) + " seconds.")
-
-    if verbose:
-        start_time = time.time()
-
-    def antialias(steps):
-
-        def _antialias_step():
-            for y in range(resize_factor * world.height):
-                for x in range(resize_factor * world.width):
-                    _antialias_point(x, y)
-
-        def _antialias_point(x, y):
-            n = 2
-            tot_r = target[x, y][0] * 2
-            tot_g = target[x, y][1] * 2
-            tot_b = target[x, y][2] * 2
-            for dy in range(-1, +2):
-                py = y + dy
-                if py > 0 and py < resize_factor * world.height:
-                    for dx in range(-1, +2):
-                        px = x + dx
-                        if px > 0 and px < resize_factor * world.width:
-                            n += 1
-                            tot_r += target[px, py][0]
-                            tot_g += target[px, py][1]
-                            tot_b += target[px, py][2]
-            r = int(tot_r / n)
-            g = int(tot_g / n)
-            b = int(tot_b / n)
-            target[x, y] = (r, g, b, 255)
-
-        for i in range(steps):
-            _antialias_step()
-
-    antialias(1)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: anti alias " +
-            "Elapsed time " + str(elapsed_time) + " seconds.")
+    with span('init'):
+        land_color = (
+            181, 166, 127, 255)  # TODO: Put this in the argument list too??
+        borders = _find_land_borders(world, resize_factor)
+        mountains_mask = _find_mountains_mask(world, resize_factor)
+        boreal_forest_mask = _find_boreal_forest_mask(world, resize_factor)
+        temperate_forest_mask = _find_temperate_forest_mask(world,
+                                                            resize_factor)
+        warm_temperate_forest_mask = \
+            _find_warm_temperate_forest_mask(world, resize_factor)
+        tropical_dry_forest_mask = \
+            _find_tropical_dry_forest_mask(world, resize_factor)
+        # jungle is actually Tropical Rain Forest and Tropical Seasonal Forest
+        jungle_mask = _mask(world, world.is_jungle,
+                            resize_factor)
+        tundra_mask = _mask(world, world.is_tundra, resize_factor)
+        # savanna is actually Tropical semi-arid
+        savanna_mask = _mask(world, world.is_savanna, resize_factor)
+        cold_parklands_mask = _mask(world, world.is_cold_parklands,
+                                    resize_factor)
+        steppe_mask = _mask(world, world.is_steppe, resize_factor)
+        cool_desert_mask = _mask(world, world.is_cool_desert, resize_factor)
+        chaparral_mask = _mask(world, world.is_chaparral, resize_factor)
+        hot_desert_mask = _mask(world, world.is_hot_desert, resize_factor)
+
+        def unset_mask(pos):
+            x, y = pos
+            mountains_mask[y][x] = False
+
+        def unset_boreal_forest_mask(pos):
+            x, y = pos
+            boreal_forest_mask[y][x] = False
+
+        def unset_temperate_forest_mask(pos):
+            x, y = pos
+            temperate_forest_mask[y][x] = False
+
+        def unset_warm_temperate_forest_mask(pos):
+            x, y = pos
+            warm_temperate_forest_mask[y][x] = False
+
+        def unset_tropical_dry_forest_mask(pos):
+            x, y = pos
+            tropical_dry_forest_mask[y][x] = False
+
+        def unset_jungle_mask(pos):
+            x, y = pos
+            jungle_mask[y][x] = False
+
+        def unset_tundra_mask(pos):
+            x, y = pos
+            tundra_mask[y][x] = False
+
+        def unset_savanna_mask(pos):
+            x, y = pos
+            savanna_mask[y][x] = False
+
+        def unset_hot_desert_mask(pos):
+            x, y = pos
+            hot_desert_mask[y][x] = False
+
+        def unset_rock_desert_mask(pos):
+            x, y = pos
+            rock_desert_mask[y][x] = False
+
+        def unset_cold_parklands_mask(pos):
+            x, y = pos
+            cold_parklands_mask[y][x] = False
+
+        def unset_steppe_mask(pos):
+            x, y = pos
+            steppe_mask[y][x] = False
+
+        def unset_cool_desert_mask(pos):
+            x, y = pos
+            cool_desert_mask[y][x] = False
+
+        def unset_chaparral_mask(pos):
+            x, y = pos
+            chaparral_mask[y][x] = False
+
+        def on_border(pos):
+            x, y = pos
+            return borders[y][x]
+
+    with span('max_min_elevation'):
+        min_elev = None
+        max_elev = None
+        for y in range(world.height):
+            for x in range(world.width):
+                e = world.elevation['data'][y][x]
+                if min_elev is None or e < min_elev:
+                    min_elev = e
+                if max_elev is None or e > max_elev:
+                    max_elev = e
+        elev_delta = max_elev - min_elev
+
+    with span('color_ocean'):
+        for y in range(resize_factor * world.height):
+            for x in range(resize_factor * world.width):
+                xf = int(x / resize_factor)
+                yf = int(y / resize_factor)
+                if borders[y][x]:
+                    target.set_pixel(x, y, (0, 0, 0, 255))
+                elif world.ocean[yf][xf]:
+                    target.set_pixel(x, y, sea_color)
+                else:
+                    target.set_pixel(x, y, land_color)
+
+    with span('anti_alias'):
+        def antialias(steps):
+
+            def _antialias_step():
+                for y in range(resize_factor * world.height):
+                    for x in range(resize_factor * world.width):
+                        _antialias_point(x, y)
+
+            def _antialias_point(x, y):
+                n = 2
+                tot_r = target[x, y][0] * 2
+                tot_g = target[x, y][1] * 2
+                tot_b = target[x, y][2] * 2
+                for dy in range(-1, +2):
+                    py = y + dy
+                    if py > 0 and py < resize_factor * world.height:
+                        for dx in range(-1, +2):
+                            px = x + dx
+                            if px > 0 and px < resize_factor * world.width:
+                                n += 1
+                                tot_r += target[px, py][0]
+                                tot_g += target[px, py][1]
+                                tot_b += target[px, py][2]
+                r = int(tot_r / n)
+                g = int(tot_g / n)
+                b = int(tot_b / n)
+                target[x, y] = (r, g, b, 255)
+
+            for i in range(steps):
+                _antialias_step()
+
+        antialias(1)
 
     # Draw glacier
-    if verbose:
-        start_time = time.time()
-    for y in range(resize_factor * world.height):
-        for x in range(resize_factor * world.width):
-            if not borders[y][x] and world.is_iceland(
-                    (int(x / resize_factor), int(y / resize_factor))):
-                _draw_glacier(target, x, y)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: draw glacier " +
-            "Elapsed time " + str(elapsed_time) + " seconds.")
+    with span('draw_glacier'):
+        for y in range(resize_factor * world.height):
+            for x in range(resize_factor * world.width):
+                if not borders[y][x] and world.is_iceland(
+                        (int(x / resize_factor), int(y / resize_factor))):
+                    _draw_glacier(target, x, y)
 
     # Draw tundra
-    if verbose:
-        start_time = time.time()
-    for y in range(resize_factor * world.height):
-        for x in range(resize_factor * world.width):
-            if tundra_mask[y][x]:
-                _draw_tundra(target, x, y)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: draw tundra " +
-            "Elapsed time " + str(elapsed_time) + " seconds.")
+    with span('draw_tundra'):
+        for y in range(resize_factor * world.height):
+            for x in range(resize_factor * world.width):
+                if tundra_mask[y][x]:
+                    _draw_tundra(target, x, y)
 
     # Draw cold parklands
     for y in range(resize_factor * world.height):
@@ -862,23 +836,18 @@ def draw_ancientmap(world, target, resize_factor=1,
     draw_rivers_on_image(world, target, resize_factor)
 
     # Draw mountains
-    if verbose:
-        start_time = time.time()
-    for y in range(resize_factor * world.height):
-        for x in range(resize_factor * world.width):
-            if mountains_mask[y][x]:
-                w = mountains_mask[y][x]
-                h = 3 + int(world.level_of_mountain(
-                    (int(x / resize_factor), int(y / resize_factor))))
-                r = max(int(w / 3 * 2), h)
-                if len(world.tiles_around_factor(resize_factor, (x, y),
-                                                 radius=r,
-                                                 predicate=on_border)) <= 2:
-                    _draw_a_mountain(target, x, y, w=w, h=h)
-                    world.on_tiles_around_factor(resize_factor, (x, y),
-                                                 radius=r, action=unset_mask)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print(
-            "...drawing_functions.draw_oldmap_on_pixel: draw mountains " +
-            "Elapsed time " + str(elapsed_time) + " seconds.")
+    with span('draw_mountains'):
+        for y in range(resize_factor * world.height):
+            for x in range(resize_factor * world.width):
+                if mountains_mask[y][x]:
+                    w = mountains_mask[y][x]
+                    h = 3 + int(world.level_of_mountain(
+                        (int(x / resize_factor), int(y / resize_factor))))
+                    r = max(int(w / 3 * 2), h)
+                    if len(world.tiles_around_factor(
+                            resize_factor, (x, y), radius=r,
+                            predicate=on_border)) <= 2:
+                        _draw_a_mountain(target, x, y, w=w, h=h)
+                        world.on_tiles_around_factor(resize_factor, (x, y),
+                                                     radius=r,
+                                                     action=unset_mask)
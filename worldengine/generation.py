@@ -1,3 +1,5 @@
+import numpy
+
 from worldengine.world import *
 from worldengine.simulations.WatermapSimulation import *
 from worldengine.simulations.IrrigationSimulation import *
@@ -9,6 +11,9 @@ from worldengine.simulations.PrecipitationSimulation import *
 from worldengine.simulations.BiomeSimulation import *
 from worldengine.simulations.basic import *
 from worldengine.common import *
+from worldengine.scheduler import run_stages
+from worldengine.timing import span
+from worldengine.noise_field import noise_map
 
 
 # ------------------
@@ -19,44 +24,27 @@ def center_land(world):
     """Translate the map horizontally and vertically to put as much ocean as
        possible at the borders. It operates on elevation and plates map"""
 
-    min_sum_on_y = None
-    y_with_min_sum = None
-    for y in range(world.height):
-        sum_on_y = 0
-        for x in range(world.width):
-            sum_on_y += world.elevation['data'][y][x]
-        if min_sum_on_y is None or sum_on_y < min_sum_on_y:
-            min_sum_on_y = sum_on_y
-            y_with_min_sum = y
-    if get_verbose():
-        print("geo.center_land: height complete")
-
-    min_sum_on_x = None
-    x_with_min_sum = None
-    for x in range(world.width):
-        sum_on_x = 0
-        for y in range(world.height):
-            sum_on_x += world.elevation['data'][y][x]
-        if min_sum_on_x is None or sum_on_x < min_sum_on_x:
-            min_sum_on_x = sum_on_x
-            x_with_min_sum = x
-    if get_verbose():
-        print("geo.center_land: width complete")
-
-    new_elevation_data = []
-    new_plates = []
-    for y in range(world.height):
-        new_elevation_data.append([])
-        new_plates.append([])
-        src_y = (y_with_min_sum + y) % world.height
-        for x in range(world.width):
-            src_x = (x_with_min_sum + x) % world.width
-            new_elevation_data[y].append(world.elevation['data'][src_y][src_x])
-            new_plates[y].append(world.plates[src_y][src_x])
-    world.elevation['data'] = new_elevation_data
-    world.plates = new_plates
-    if get_verbose():
-        print("geo.center_land: width complete")
+    elevation = world.elevation['data']
+    y_with_min_sum = int(numpy.argmin(elevation.sum(axis=1)))
+    x_with_min_sum = int(numpy.argmin(elevation.sum(axis=0)))
+
+    # the row and the column with the minimum sum become the first ones
+    def recenter(data):
+        data = numpy.roll(data, -y_with_min_sum, axis=0)
+        return numpy.roll(data, -x_with_min_sum, axis=1)
+
+    world.set_elevation(recenter(elevation), world.elevation['thresholds'])
+    world.set_plates(recenter(world.plates))
+
+
+def _border_ramp(length, ocean_border):
+    """Factor by which the elevation is scaled along a side of the map: it
+    goes from 0 at the border to 1 at ocean_border cells from it"""
+    ramp = numpy.ones(length)
+    for i in range(ocean_border):
+        ramp[i] *= float(i) / ocean_border
+        ramp[length - i - 1] *= float(i) / ocean_border
+    return ramp
 
 
 def place_oceans_at_map_borders(world):
@@ -65,56 +53,105 @@ def place_oceans_at_map_borders(world):
     """
 
     ocean_border = int(min(30, max(world.width / 5, world.height / 5)))
-
-    def place_ocean(x, y, i):
-        world.elevation['data'][y][x] = (world.elevation['data'][y][x] * i) / \
-                                        ocean_border
-
-    for x in range(world.width):
-        for i in range(ocean_border):
-            place_ocean(x, i, i)
-            place_ocean(x, world.height - i - 1, i)
-
-    for y in range(world.height):
-        for i in range(ocean_border):
-            place_ocean(i, y, i)
-            place_ocean(world.width - i - 1, y, i)
+    ramp = numpy.outer(_border_ramp(world.height, ocean_border),
+                       _border_ramp(world.width, ocean_border))
+    world.elevation['data'] *= ramp
 
 
 def add_noise_to_elevation(world, seed):
     octaves = 6
     freq = 16.0 * octaves
-    for y in range(world.height):
-        for x in range(world.width):
-            n = snoise2(x / freq * 2, y / freq * 2, octaves, base=seed)
-            world.elevation['data'][y][x] += n
+    world.elevation['data'] += noise_map(world.width, world.height,
+                                         freq / 2, octaves, seed)
+
+
+def _runs(mask):
+    """Find the runs of True cells of each row of a bool map.
+
+    :return: the row, the first and the last column of each run, sorted by
+             row and column
+    """
+    height, width = mask.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+    changes = numpy.diff(padded.ravel())
+    starts = numpy.nonzero(changes == 1)[0]
+    ends = numpy.nonzero(changes == -1)[0]
+    rows = starts // (width + 2)
+    return rows, starts % (width + 2), ends % (width + 2) - 1
+
+
+def _connected_runs(rows, starts, ends, width):
+    """Find the pairs of runs, on adjacent rows, which touch each other,
+    also diagonally"""
+    # runs are sorted by row and column, so these keys are sorted too
+    stride = width + 3
+    start_keys = rows * stride + starts + 1
+    end_keys = rows * stride + ends + 1
+    # for each run, the runs of the next row from the first one ending
+    # after its start to the last one starting before its end
+    first = numpy.searchsorted(end_keys, (rows + 1) * stride + starts)
+    last = numpy.searchsorted(start_keys, (rows + 1) * stride + ends + 3)
+    counts = numpy.maximum(last - first, 0)
+    a = numpy.repeat(numpy.arange(len(rows)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts)
+    b = numpy.repeat(first, counts) + offsets
+    return a, b
+
+
+def _components(n, a, b):
+    """Label the connected components of a graph of n nodes, given its
+    edges: each node gets the smallest node of its component"""
+    labels = numpy.arange(n)
+    while True:
+        la = labels[a]
+        lb = labels[b]
+        smallest = numpy.minimum(la, lb)
+        hooked = labels.copy()
+        numpy.minimum.at(hooked, la, smallest)
+        numpy.minimum.at(hooked, lb, smallest)
+        while True:
+            compressed = hooked[hooked]
+            if numpy.array_equal(compressed, hooked):
+                break
+            hooked = compressed
+        if numpy.array_equal(hooked, labels):
+            return labels
+        labels = hooked
 
 
 def fill_ocean(elevation, sea_level):
-    width = len(elevation[0])
-    height = len(elevation)
-
-    ocean = [[False for x in range(width)] for y in range(height)]
-    to_expand = []
-    for x in range(width):
-        if elevation[0][x] <= sea_level:
-            to_expand.append((x, 0))
-        if elevation[height - 1][x] <= sea_level:
-            to_expand.append((x, height - 1))
-    for y in range(height):
-        if elevation[y][0] <= sea_level:
-            to_expand.append((0, y))
-        if elevation[y][width - 1] <= sea_level:
-            to_expand.append((width - 1, y))
-    for t in to_expand:
-        tx, ty = t
-        if not ocean[ty][tx]:
-            ocean[ty][tx] = True
-            for px, py in _around(tx, ty, width, height):
-                if not ocean[py][px] and elevation[py][px] <= sea_level:
-                    to_expand.append((px, py))
-
-    return ocean
+    """Find the ocean: the cells at or below the sea level connected, also
+    diagonally, to the borders of the map. The cells are grouped in runs
+    of each row, which are then labelled as connected components.
+
+    :return: a bool map of the ocean and a map of ocean basin ids: each
+             ocean basin has a different id, starting from 1, while land
+             and lakes have id 0
+    """
+    water = numpy.asarray(elevation) <= sea_level
+    height, width = water.shape
+
+    rows, starts, ends = _runs(water)
+    a, b = _connected_runs(rows, starts, ends, width)
+    labels = _components(len(rows), a, b)
+
+    # the components touching the borders are the basins of the ocean
+    on_border = (rows == 0) | (rows == height - 1) | (starts == 0) | \
+                (ends == width - 1)
+    is_ocean = numpy.zeros(len(rows), dtype=bool)
+    is_ocean[labels[on_border]] = True
+    basin_ids = numpy.cumsum(is_ocean) * is_ocean
+    run_basins = basin_ids[labels]
+
+    # paint the basin id of each run on its cells
+    flat = numpy.zeros(height * width + 1, dtype=numpy.int64)
+    numpy.add.at(flat, rows * width + starts, run_basins)
+    numpy.add.at(flat, rows * width + ends + 1, -run_basins)
+    basins = numpy.cumsum(flat[:-1]).reshape(height, width).astype(
+        numpy.int32)
+    return basins > 0, basins
 
 
 def initialize_ocean_and_thresholds(world, ocean_level=1.0):
@@ -125,85 +162,81 @@ def initialize_ocean_and_thresholds(world, ocean_level=1.0):
     :return: nothing, the world will be changed
     """
     e = world.elevation['data']
-    ocean = fill_ocean(e, ocean_level)
-    hl = find_threshold_f(e, 0.10)
-    ml = find_threshold_f(e, 0.03)
+    with span('fill_ocean'):
+        ocean, basins = fill_ocean(e, ocean_level)
+    hl, ml = find_thresholds(e, [0.10, 0.03])
     e_th = [('sea', ocean_level),
             ('plain', hl),
             ('hill', ml),
             ('mountain', None)]
-    world.set_ocean(ocean)
+    world.set_ocean(ocean, basins)
     world.set_elevation(e, e_th)
-    world.sea_depth = sea_depth(world, ocean_level)
+    with span('sea_depth'):
+        world.set_sea_depth(sea_depth(world, ocean_level))
 
 
 # ----
 # Misc
 # ----
 
+def _land_around(land, radius):
+    """For each cell, if there is land among the other cells within the
+    given radius. The land cells are counted with an integral image."""
+    height, width = land.shape
+    counts = numpy.zeros((height + 1, width + 1), dtype=numpy.int64)
+    counts[1:, 1:] = land.cumsum(axis=0).cumsum(axis=1)
+    ys = numpy.arange(height)
+    xs = numpy.arange(width)
+    y0 = numpy.clip(ys - radius, 0, height)
+    y1 = numpy.clip(ys + radius + 1, 0, height)
+    x0 = numpy.clip(xs - radius, 0, width)
+    x1 = numpy.clip(xs + radius + 1, 0, width)
+    in_square = counts[numpy.ix_(y1, x1)] - counts[numpy.ix_(y0, x1)] - \
+        counts[numpy.ix_(y1, x0)] + counts[numpy.ix_(y0, x0)]
+    return in_square - land > 0
+
+
 def sea_depth(world, sea_level):
-    sea_depth = [[sea_level - world.elevation['data'][y][x]
-                  for x in range(world.width)] for y in range(world.height)]
-    for y in range(world.height):
-        for x in range(world.width):
-            if world.tiles_around((x, y), radius=1, predicate=world.is_land):
-                sea_depth[y][x] = 0
-            elif world.tiles_around((x, y), radius=2, predicate=world.is_land):
-                sea_depth[y][x] *= 0.3
-            elif world.tiles_around((x, y), radius=3, predicate=world.is_land):
-                sea_depth[y][x] *= 0.5
-            elif world.tiles_around((x, y), radius=4, predicate=world.is_land):
-                sea_depth[y][x] *= 0.7
-            elif world.tiles_around((x, y), radius=5, predicate=world.is_land):
-                sea_depth[y][x] *= 0.9
-    sea_depth = antialias(sea_depth, 10)
-    min_depth, max_depth = matrix_min_and_max(sea_depth)
-    sea_depth = [[rescale_value(sea_depth[y][x], min_depth,
-                                max_depth, 0.0, 1.0)
-                  for x in range(world.width)] for y in
-                 range(world.height)]
-    return sea_depth
-
-
-def _around(x, y, width, height):
-    ps = []
-    for dx in range(-1, 2):
-        nx = x + dx
-        if 0 <= nx < width:
-            for dy in range(-1, 2):
-                ny = y + dy
-                if 0 <= ny < height and (dx != 0 or dy != 0):
-                    ps.append((nx, ny))
-    return ps
-
-
-def generate_world(w, step):
+    # the depth is reduced near the land: by the factor corresponding to
+    # the (Chebyshev) distance from the nearest land cell
+    factors = [0.0, 0.0, 0.3, 0.5, 0.7, 0.9, 1.0]
+    land = numpy.logical_not(world.ocean)
+    distance = numpy.empty(land.shape, dtype=numpy.int8)
+    distance.fill(len(factors) - 1)
+    for radius in range(len(factors) - 2, 0, -1):
+        distance[_land_around(land, radius)] = radius
+
+    sea_depth = (sea_level - world.elevation['data']) * \
+        numpy.array(factors)[distance]
+    sea_depth = antialias(sea_depth, 10, closed_form=True)
+    min_depth = sea_depth.min()
+    max_depth = sea_depth.max()
+    return (sea_depth - min_depth) / (max_depth - min_depth)
+
+
+def generate_world(w, step, checkpoint_dir=None):
     if isinstance(step, str):
         step = Step.get_by_name(step)
-    seed = w.seed
 
     if not step.include_precipitations:
         return w
 
     # Precipitation with thresholds
-    PrecipitationSimulation().execute(w, seed)
-
-    if not step.include_erosion:
+    stages = [('precipitation', PrecipitationSimulation())]
+    if step.include_erosion:
+        stages += [('erosion', ErosionSimulation()),
+                   ('watermap', WatermapSimulation()),
+                   ('irrigation', IrrigationSimulation()),
+                   ('humidity', HumiditySimulation()),
+                   ('temperature', TemperatureSimulation()),
+                   ('permeability', PermeabilitySimulation()),
+                   ('biome', BiomeSimulation())]
+    with span('simulations'):
+        results = run_stages(w, stages, checkpoint_dir)
+
+    if 'biome' not in results:
         return w
-    ErosionSimulation().execute(w, seed)
-    if get_verbose():
-        print("...erosion calculated")
-
-    WatermapSimulation().execute(w, seed)
-
-    # FIXME: create setters
-    IrrigationSimulation().execute(w, seed)
-    HumiditySimulation().execute(w, seed)
-
-    TemperatureSimulation().execute(w, seed)
-    PermeabilitySimulation().execute(w, seed)
-
-    cm, biome_cm = BiomeSimulation().execute(w, seed)
+    cm, biome_cm = results['biome']
     for cl in cm.keys():
         count = cm[cl]
         if get_verbose():
@@ -0,0 +1,131 @@
+"""
+Memory used by the generation of a world.
+
+The memory used by the process (its resident set size) is sampled by a
+thread while the stages are executed, keeping the peak reached by each of
+them. Sampling finds also the transient copies done within a stage, which
+are freed before it ends.
+
+The memory is the one of the whole process, so the peak of stages executed
+at the same time by different threads is shared: each of them records the
+names of the others (see Sampler). Where the current memory cannot be read
+only the peak of the whole life of the process is available, see
+rss_source.
+"""
+
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _page_size():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+_PAGE_SIZE = _page_size()
+
+
+def _statm_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def rss_source():
+    """Return what current_rss measures: 'current' for the memory used now,
+    'peak' for the peak of the whole life of the process (so the increase
+    of a stage is 0 once a higher peak has been reached) or None when the
+    memory cannot be measured, as on Windows."""
+    if _statm_rss() is not None:
+        return 'current'
+    if resource is not None:
+        return 'peak'
+    return None
+
+
+def current_rss():
+    """Return the bytes of memory used by the process, or None when they
+    cannot be read. Where /proc is not available the peak is returned."""
+    rss = _statm_rss()
+    if rss is not None or resource is None:
+        return rss
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _encloses(outer, s):
+    while s is not None:
+        if s is outer:
+            return True
+        s = s.parent
+    return False
+
+
+def _overlap(s, other):
+    names = s.attributes.setdefault('memory.overlapping', [])
+    if other.name not in names:
+        names.append(other.name)
+    s.maxima['memory.overlapping_stages'] = len(names)
+
+
+class Sampler(object):
+    """A thread sampling the memory used by the process, to find the peak
+    of each of the spans watched. The spans watched at the same time, not
+    nested one in the other, get the peak of each other: their names are
+    recorded in the attribute memory.overlapping and their number in
+    memory.overlapping_stages."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is None:
+            return
+        with self._lock:
+            for s, start in self._watched.values():
+                if rss > s.maxima.get('memory.peak_rss', 0):
+                    s.maxima['memory.peak_rss'] = rss
+                    s.maxima['memory.peak_increase'] = max(rss - start, 0)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def watch(self, s):
+        start = current_rss()
+        if start is None:
+            return
+        with self._lock:
+            for other, _ in self._watched.values():
+                if not _encloses(other, s):
+                    _overlap(s, other)
+                    _overlap(other, s)
+            self._watched[id(s)] = (s, start)
+        self._sample()
+
+    def unwatch(self, s):
+        self._sample()
+        with self._lock:
+            self._watched.pop(id(s), None)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,319 @@
+"""
+Simplex noise calculated for a whole map at once.
+
+It is a port of noise2, noise3 and snoise2 of the noise library on numpy
+arrays: the calculations are done in single precision, as in the library,
+so that the values are the same given by snoise2 for the same coordinates.
+
+Noise maps can be cached on disk (see set_noise_cache), so that the same
+maps are not calculated again when the same seed is used.
+"""
+
+import hashlib
+import os
+import tempfile
+import numpy
+
+from worldengine.common import for_each_band, replace_file
+
+# ----------------
+# Global variables
+# ----------------
+
+# Directory of the noise cache, None when the cache is disabled
+noise_cache_dir = None
+# Maximum size of the noise cache, in bytes
+noise_cache_size = 256 * 1024 * 1024
+
+# To be changed when the calculated noise changes, so that old entries of
+# the cache are not used
+_CACHE_VERSION = 2
+
+
+def get_noise_cache():
+    return noise_cache_dir, noise_cache_size
+
+
+def set_noise_cache(directory, max_size=256 * 1024 * 1024):
+    """
+    Cache the noise maps in the given directory, removing the least recently
+    used ones when the cache gets larger than max_size bytes. A directory
+    set to None disables the cache.
+    """
+    global noise_cache_dir, noise_cache_size
+    if max_size <= 0:
+        raise Exception("The size of the noise cache should be positive")
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    noise_cache_dir = directory
+    noise_cache_size = max_size
+
+# Skewing factors for the 2D simplex grid: (sqrt(3) - 1) / 2 and
+# (3 - sqrt(3)) / 6
+_F2 = numpy.float32(0.3660254037844386)
+_G2 = numpy.float32(0.21132486540518713)
+_G2_TWICE = _G2 * numpy.float32(2.0)
+_ONE = numpy.float32(1.0)
+# Skewing factors for the 3D simplex grid
+_F3 = numpy.float32(1.0) / numpy.float32(3.0)
+_G3 = numpy.float32(1.0) / numpy.float32(6.0)
+# 1 / pi, as M_1_PI
+_1_PI = 0.31830988618379067154
+
+_PERM = numpy.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225,
+    140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247,
+    120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177,
+    33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165,
+    71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211,
+    133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25,
+    63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196,
+    135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217,
+    226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206,
+    59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248,
+    152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22,
+    39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218,
+    246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241,
+    81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157,
+    184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93,
+    222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180
+] * 2, dtype=numpy.int32)
+
+# x, y and z components of the first 12 gradients of the noise library
+_GRAD_X = numpy.array([1, -1, 1, -1, 1, -1, 1, -1, 0, 0, 0, 0],
+                      dtype=numpy.float32)
+_GRAD_Y = numpy.array([1, 1, -1, -1, 0, 0, 0, 0, 1, -1, 1, -1],
+                      dtype=numpy.float32)
+_GRAD_Z = numpy.array([0, 0, 0, 0, 1, 1, -1, -1, 1, 1, -1, -1],
+                      dtype=numpy.float32)
+
+
+def _corner(g, x, y):
+    """Contribution of a corner of the simplex, given its gradient and the
+    distance from it"""
+    f = numpy.float32(0.5) - x * x - y * y
+    n = f * f * f * f * (_GRAD_X[g] * x + _GRAD_Y[g] * y)
+    n[f <= 0] = 0.0
+    return n
+
+
+def noise2(x, y):
+    """Simplex noise in the given points, as float32 arrays"""
+    s = (x + y) * _F2
+    i = numpy.floor(x + s)
+    j = numpy.floor(y + s)
+    t = (i + j) * _G2
+
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    i1 = x0 > y0
+    j1 = numpy.logical_not(i1)
+
+    x1 = x0 - i1.astype(numpy.float32) + _G2
+    y1 = y0 - j1.astype(numpy.float32) + _G2
+    x2 = x0 + _G2_TWICE - _ONE
+    y2 = y0 + _G2_TWICE - _ONE
+
+    ii = i.astype(numpy.int32) & 255
+    jj = j.astype(numpy.int32) & 255
+    g0 = _PERM[ii + _PERM[jj]] % 12
+    g1 = _PERM[ii + i1 + _PERM[jj + j1]] % 12
+    g2 = _PERM[ii + 1 + _PERM[jj + 1]] % 12
+
+    n = _corner(g0, x0, y0) + _corner(g1, x1, y1) + _corner(g2, x2, y2)
+    return n * numpy.float32(70.0)
+
+
+def _corner3(g, x, y, z):
+    f = numpy.float32(0.6) - x * x - y * y - z * z
+    n = f * f * f * f * (x * _GRAD_X[g] + y * _GRAD_Y[g] + z * _GRAD_Z[g])
+    n[f <= 0] = 0.0
+    return n
+
+
+def noise3(x, y, z):
+    """Simplex noise in the given 3D points, as float32 arrays"""
+    s = (x + y + z) * _F3
+    i = numpy.floor(x + s)
+    j = numpy.floor(y + s)
+    k = numpy.floor(z + s)
+    t = (i + j + k) * _G3
+
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    z0 = z - (k - t)
+
+    # offsets of the second and third corners of the simplex
+    a = x0 >= y0
+    b = y0 >= z0
+    c = x0 >= z0
+    not_a = numpy.logical_not(a)
+    not_b = numpy.logical_not(b)
+    o1 = [a & (b | c), not_a & b, (a & not_b & numpy.logical_not(c)) |
+          (not_a & not_b)]
+    o2 = [a | (b & c), b | not_a, (a & not_b) |
+          (not_a & numpy.logical_not(b & c))]
+
+    p0 = (x0, y0, z0)
+    p1 = [p0[d] - o1[d].astype(numpy.float32) + _G3 for d in range(3)]
+    p2 = [p0[d] - o2[d].astype(numpy.float32) + numpy.float32(2.0) * _G3
+          for d in range(3)]
+    p3 = [p0[d] - _ONE + numpy.float32(3.0) * _G3 for d in range(3)]
+
+    ii = i.astype(numpy.int32) & 255
+    jj = j.astype(numpy.int32) & 255
+    kk = k.astype(numpy.int32) & 255
+    g0 = _PERM[ii + _PERM[jj + _PERM[kk]]] % 12
+    g1 = _PERM[ii + o1[0] + _PERM[jj + o1[1] + _PERM[o1[2] + kk]]] % 12
+    g2 = _PERM[ii + o2[0] + _PERM[jj + o2[1] + _PERM[o2[2] + kk]]] % 12
+    g3 = _PERM[ii + 1 + _PERM[jj + 1 + _PERM[kk + 1]]] % 12
+
+    n = _corner3(g0, *p0) + _corner3(g1, *p1) + _corner3(g2, *p2) + \
+        _corner3(g3, *p3)
+    return n * numpy.float32(32.0)
+
+
+def _fast_sin(x):
+    """Approximated sine of the noise library: x in [0, 2] is a turn"""
+    offset = numpy.float32(25165824.0)
+    x = x - ((x + offset) - offset)
+    y = x - x * numpy.abs(x)
+    return y * (numpy.float32(3.1) + numpy.float32(3.6) * numpy.abs(y))
+
+
+def snoise2_field(xs, ys, octaves=1, persistence=0.5, lacunarity=2.0,
+                  repeatx=None, base=0.0):
+    """Octave-summed simplex noise, as calculated by snoise2, for every
+    combination of the given x and y coordinates.
+
+    When repeatx is given the noise repeats along x with that period: as
+    snoise2 does, the x axis is wrapped around a cylinder in a 3D noise.
+
+    :param xs: the x coordinates, one for each column
+    :param ys: the y coordinates, one for each row
+    :return: an array of float, with a row for each y and a column for each x
+    """
+    if octaves <= 0:
+        raise Exception("Expected octaves value > 0")
+    x = numpy.asarray(xs, dtype=numpy.float32)[numpy.newaxis, :]
+    y = numpy.asarray(ys, dtype=numpy.float32)[:, numpy.newaxis]
+    z = numpy.float32(base)
+    persistence = numpy.float32(persistence)
+    lacunarity = numpy.float32(lacunarity)
+
+    if repeatx is None:
+        x, y = numpy.broadcast_arrays(x, y)
+
+        def octave(freq):
+            return noise2(x * freq + z, y * freq + z)
+    else:
+        # the period as a single precision value, then in double precision
+        repeatx = float(numpy.float32(repeatx))
+        xf = (x.astype(numpy.float64) * 2.0 / repeatx).astype(numpy.float32)
+        xr = numpy.float32(repeatx * _1_PI * 0.5)
+        cx, cy, cz = numpy.broadcast_arrays(
+            _fast_sin(xf) * xr, y,
+            z + _fast_sin(xf + numpy.float32(0.5)) * xr)
+
+        def octave(freq):
+            return noise3(cx * freq, cy * freq, cz * freq)
+
+    freq = numpy.float32(1.0)
+    amp = numpy.float32(1.0)
+    total_amp = numpy.float32(1.0)
+    total = octave(freq)
+    for _ in range(1, octaves):
+        freq *= lacunarity
+        amp *= persistence
+        total_amp += amp
+        total += octave(freq) * amp
+    return (total / total_amp).astype(numpy.float64)
+
+
+def _cache_key(*params):
+    key = repr((_CACHE_VERSION,) + params)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _evict(directory, max_size):
+    """Remove the least recently used entries until the cache fits in
+    max_size bytes"""
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _cached(calculate, *params):
+    """Return the noise map calculated by calculate(*params), reading it
+    from the noise cache, memory-mapped, when it is there"""
+    directory, max_size = get_noise_cache()
+    if directory is None:
+        return calculate(*params)
+    path = os.path.join(directory, _cache_key(calculate.__name__,
+                                              *params) + '.npy')
+    if os.path.exists(path):
+        try:
+            data = numpy.load(path, mmap_mode='r')
+            # touch the entry to keep track of the last use
+            os.utime(path, None)
+            return data
+        except (IOError, OSError, ValueError):
+            pass
+    data = calculate(*params)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        numpy.save(f, data)
+    try:
+        replace_file(tmp_path, path)
+    except OSError:
+        # another process has just written the same entry (on Windows it
+        # can also be in use): keep that one
+        os.remove(tmp_path)
+        if not os.path.exists(path):
+            raise
+        return data
+    _evict(directory, max_size)
+    return data
+
+
+def _noise_map(width, height, freq, octaves, base, repeatx=None):
+    xs = numpy.arange(width, dtype=numpy.float64) / freq
+    ys = numpy.arange(height, dtype=numpy.float64) / freq
+    n = numpy.empty((height, width))
+
+    def calculate_band(y_start, y_end):
+        n[y_start:y_end] = snoise2_field(xs, ys[y_start:y_end], octaves,
+                                         repeatx=repeatx, base=base)
+    for_each_band(height, calculate_band)
+    return n
+
+
+def noise_map(width, height, freq, octaves, base):
+    """Noise for each cell of a map: the cell (x, y) gets the value of
+    snoise2(x / freq, y / freq, octaves, base=base).
+    The map returned can be read-only."""
+    return _cached(_noise_map, width, height, float(freq), octaves, base)
+
+
+def wrapped_noise_map(width, height, freq, octaves, base):
+    """Noise for each cell of a map, wrapping around right and left: the
+    cell (x, y) gets the value of
+    snoise2(x / freq, y / freq, octaves, repeatx=width / freq, base=base).
+    The map returned can be read-only."""
+    return _cached(_noise_map, width, height, float(freq), octaves, base,
+                   width / float(freq))
@@ -1,11 +1,14 @@
 # Every reference to platec has to be kept separated because it is a C
 # extension which is not available when using this project from jython
 
-import time
+import numpy
 import platec
 
 from worldengine.generation import *
 from worldengine.common import *
+from worldengine.timing import span
+from worldengine.checkpoint import save_checkpoint, load_checkpoint, \
+    checkpoint_stage
 
 
 def generate_plates_simulation(seed, width, height, sea_level=0.65,
@@ -14,21 +17,20 @@ def generate_plates_simulation(seed, width, height, sea_level=0.65,
                                cycle_count=2, num_plates=10,
                                verbose=get_verbose()):
 
-    if verbose:
-        start_time = time.time()
-    p = platec.create(seed, width, height, sea_level, erosion_period,
-                      folding_ratio, aggr_overlap_abs, aggr_overlap_rel,
-                      cycle_count, num_plates)
+    with span('plates.generate_plates_simulation', verbose=verbose,
+              stage=True) as s:
+        p = platec.create(seed, width, height, sea_level, erosion_period,
+                          folding_ratio, aggr_overlap_abs, aggr_overlap_rel,
+                          cycle_count, num_plates)
 
-    while platec.is_finished(p) == 0:
-        # TODO: add a if verbose: message here?
-        platec.step(p)
-    hm = platec.get_heightmap(p)
-    pm = platec.get_platesmap(p)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print("...plates.generate_plates_simulation() complete. " +
-              "Elapsed time " + str(elapsed_time) + " seconds.")
+        steps = 0
+        while platec.is_finished(p) == 0:
+            with span('platec.step', verbose=False):
+                platec.step(p)
+            steps += 1
+        s.attributes['steps'] = steps
+        hm = platec.get_heightmap(p)
+        pm = platec.get_platesmap(p)
     return hm, pm
 
 
@@ -40,39 +42,46 @@ def _plates_simulation(name, width, height, seed, num_plates=10,
                                                         verbose=verbose)
 
     world = World(name, width, height, seed, num_plates, ocean_level, step)
-    world.set_elevation(array_to_matrix(e_as_array, width, height), None)
-    world.set_plates(array_to_matrix(p_as_array, width, height))
+    world.set_elevation(_as_map(e_as_array, width, height), None)
+    world.set_plates(_as_map(p_as_array, width, height))
     return world
 
 
-def world_gen(name, width, height, seed, num_plates=10, ocean_level=1.0,
-              step=Step.full(), verbose=get_verbose()):
-    if verbose:
-        start_time = time.time()
-    world = _plates_simulation(name, width, height, seed, num_plates,
-                               ocean_level, step, verbose)
+def _as_map(array, width, height):
+    if len(array) != (width * height):
+        raise Exception("Array as not expected length")
+    return numpy.asarray(array).reshape(height, width)
 
-    center_land(world)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print("...plates.world_gen: set_elevation, set_plates, center_land " +
-              "complete. Elapsed time " + str(elapsed_time) + " seconds.")
 
-    if verbose:
-        start_time = time.time()
-    add_noise_to_elevation(world, random.randint(0, 4096))
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print("...plates.world_gen: elevation noise added. Elapsed time " +
-              str(elapsed_time) + " seconds.")
+def world_gen(name, width, height, seed, num_plates=10, ocean_level=1.0,
+              step=Step.full(), verbose=get_verbose(), checkpoint_dir=None,
+              resume=False):
+    """Generate a world. When checkpoint_dir is given the world is saved
+    there after each stage and, with resume, the generation continues from
+    the last stage saved"""
+    with span('plates.world_gen', verbose=verbose, width=width,
+              height=height, seed=seed):
+        world = None
+        if resume and checkpoint_dir is not None:
+            world = load_checkpoint(checkpoint_dir, name, width, height, seed,
+                                    num_plates, ocean_level, step)
+            if verbose and world is not None:
+                print("...plates.world_gen: resuming after stage %s" %
+                      checkpoint_stage(checkpoint_dir, name))
+        if world is None:
+            world = _plates_simulation(name, width, height, seed, num_plates,
+                                       ocean_level, step, verbose)
+            save_checkpoint(checkpoint_dir, world, 'plates')
 
-    if verbose:
-        start_time = time.time()
-    place_oceans_at_map_borders(world)
-    initialize_ocean_and_thresholds(world)
-    if verbose:
-        elapsed_time = time.time() - start_time
-        print("...plates.world_gen: oceans initialized. Elapsed time " +
-              str(elapsed_time) + " seconds.")
+        if not world.has_ocean():
+            with span('center_land', stage=True):
+                center_land(world)
+            with span('add_noise_to_elevation', stage=True):
+                add_noise_to_elevation(world, random.randint(0, 4096))
+            with span('place_oceans_at_map_borders', stage=True):
+                place_oceans_at_map_borders(world)
+            with span('initialize_ocean_and_thresholds', stage=True):
+                initialize_ocean_and_thresholds(world)
+            save_checkpoint(checkpoint_dir, world, 'initial')
 
-    return generate_world(world, step)
+        return generate_world(world, step, checkpoint_dir)
@@ -0,0 +1,118 @@
+"""
+Execution of the simulations of the generation of a world.
+
+Each simulation declares the layers it reads (inputs) and the layers it
+writes (outputs). Given the simulations in the order in which they would be
+executed one after the other, a simulation has to wait for the earlier ones
+which write a layer it reads or writes, or which read a layer it writes.
+The others can be executed at the same time: the result is the same of
+executing them one after the other.
+
+The simulations are executed by threads: most of their work is done by
+numpy, which releases the GIL, and the layers of the world can be shared
+without copying them.
+"""
+
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from worldengine.checkpoint import save_checkpoint
+from worldengine.common import get_workers
+from worldengine.timing import span, current_span
+
+
+def dependencies(stages):
+    """For each stage, the set of the earlier stages it has to wait for.
+
+    :param stages: a list of (name, simulation)
+    """
+    deps = {}
+    for i, (name, simulation) in enumerate(stages):
+        reads = set(simulation.inputs)
+        writes = set(simulation.outputs)
+        deps[name] = set()
+        for earlier_name, earlier in stages[:i]:
+            earlier_writes = set(earlier.outputs)
+            if (earlier_writes & (reads | writes)) or \
+                    (set(earlier.inputs) & writes):
+                deps[name].add(earlier_name)
+    return deps
+
+
+def run_stages(world, stages, checkpoint_dir=None, workers=None):
+    """Execute the stages applicable to the world, as many at the same time
+    as the workers (by default the ones set with set_workers), respecting
+    their dependencies. A checkpoint is saved when a stage completes and no
+    other is running.
+
+    :param stages: a list of (name, simulation), in the order in which they
+                   would be executed one after the other
+    :return: a dict with the result of each stage executed
+    """
+    if workers is None:
+        workers = get_workers()
+    deps = dependencies(stages)
+    pending = [name for name, _ in stages]
+    simulations = dict(stages)
+    done = set()
+    running = set()
+    results = {}
+    completed = queue.Queue()
+    error = None
+    # the spans of the stages executed by other threads are nested here
+    parent = current_span()
+
+    def execute(name):
+        with span(name, parent=parent, stage=True):
+            return simulations[name].execute(world, world.seed)
+
+    def execute_in_thread(name):
+        try:
+            completed.put((name, execute(name), None))
+        except Exception as e:
+            completed.put((name, None, e))
+
+    while pending or running:
+        # start the stages ready, in order
+        for name in list(pending):
+            if error is not None or len(running) >= workers:
+                break
+            if not deps[name] <= done:
+                continue
+            pending.remove(name)
+            # is_applicable is checked only when the stages before are
+            # done, as their outputs can make the simulation applicable
+            if not simulations[name].is_applicable(world):
+                done.add(name)
+                continue
+            if workers == 1:
+                results[name] = execute(name)
+                done.add(name)
+                save_checkpoint(checkpoint_dir, world, name)
+                continue
+            running.add(name)
+            thread = threading.Thread(target=execute_in_thread, args=(name,))
+            thread.daemon = True
+            thread.start()
+        if not running:
+            if error is not None or not pending:
+                break
+            continue
+
+        name, result, e = completed.get()
+        running.remove(name)
+        if e is not None:
+            error = error or e
+            continue
+        results[name] = result
+        done.add(name)
+        if not running and error is None:
+            save_checkpoint(checkpoint_dir, world, name)
+
+    if error is not None:
+        raise error
+    return results
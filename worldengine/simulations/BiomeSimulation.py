@@ -1,111 +1,75 @@
+import numpy
+
+from worldengine.biome import biome_name_to_index, biome_index_to_name
+from worldengine.world import TEMPERATURE_CLASSES, HUMIDITY_CLASSES
+
+# Biome of the land cells: there is a row for each class in
+# TEMPERATURE_CLASSES and a column for each class in HUMIDITY_CLASSES
+_BIOMES = [
+    # polar
+    ['polar desert', 'ice', 'ice', 'ice', 'ice', 'ice', 'ice', 'ice'],
+    # alpine
+    ['subpolar dry tundra', 'subpolar moist tundra', 'subpolar wet tundra',
+     'subpolar rain tundra', 'subpolar rain tundra', 'subpolar rain tundra',
+     'subpolar rain tundra', 'subpolar rain tundra'],
+    # boreal
+    ['boreal desert', 'boreal dry scrub', 'boreal moist forest',
+     'boreal wet forest', 'boreal rain forest', 'boreal rain forest',
+     'boreal rain forest', 'boreal rain forest'],
+    # cool
+    ['cool temperate desert', 'cool temperate desert scrub',
+     'cool temperate steppe', 'cool temperate moist forest',
+     'cool temperate wet forest', 'cool temperate rain forest',
+     'cool temperate rain forest', 'cool temperate rain forest'],
+    # warm
+    ['warm temperate desert', 'warm temperate desert scrub',
+     'warm temperate thorn scrub', 'warm temperate dry forest',
+     'warm temperate moist forest', 'warm temperate wet forest',
+     'warm temperate rain forest', 'warm temperate rain forest'],
+    # subtropical
+    ['subtropical desert', 'subtropical desert scrub',
+     'subtropical thorn woodland', 'subtropical dry forest',
+     'subtropical moist forest', 'subtropical wet forest',
+     'subtropical rain forest', 'subtropical rain forest'],
+    # tropical
+    ['tropical desert', 'tropical desert scrub', 'tropical thorn woodland',
+     'tropical very dry forest', 'tropical dry forest',
+     'tropical moist forest', 'tropical wet forest', 'tropical rain forest']
+]
+
+
+def _count(classes, names):
+    counts = numpy.bincount(classes.ravel(), minlength=len(names))
+    return dict((names[i], int(counts[i])) for i in range(len(names))
+                if counts[i] > 0)
+
+
 class BiomeSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['ocean', 'temperature', 'humidity']
+    outputs = ['biome']
 
     def is_applicable(self, world):
         return world.has_humidity() and world.has_temperature() and \
                (not world.has_biome())
 
     def execute(self, world, seed):
-        w = world
-        width = world.width
-        height = world.height
         ocean = world.ocean
-        cm = {}
-        biome_cm = {}
-        biome = [[None for x in xrange(width)] for y in xrange(height)]
-        for y in xrange(height):
-            for x in xrange(width):
-                if ocean[y][x]:
-                    biome[y][x] = 'ocean'
-                else:
-                    if w.is_temperature_polar((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'polar desert'
-                        else:
-                            biome[y][x] = 'ice'
-                    elif w.is_temperature_alpine((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'subpolar dry tundra'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'subpolar moist tundra'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'subpolar wet tundra'
-                        else:
-                            biome[y][x] = 'subpolar rain tundra'
-                    elif w.is_temperature_boreal((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'boreal desert'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'boreal dry scrub'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'boreal moist forest'
-                        elif w.is_humidity_semiarid((x, y)):
-                            biome[y][x] = 'boreal wet forest'
-                        else:
-                            biome[y][x] = 'boreal rain forest'
-                    elif w.is_temperature_cool((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'cool temperate desert'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'cool temperate desert scrub'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'cool temperate steppe'
-                        elif w.is_humidity_semiarid((x, y)):
-                            biome[y][x] = 'cool temperate moist forest'
-                        elif w.is_humidity_subhumid((x, y)):
-                            biome[y][x] = 'cool temperate wet forest'
-                        else:
-                            biome[y][x] = 'cool temperate rain forest'
-                    elif w.is_temperature_warm((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'warm temperate desert'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'warm temperate desert scrub'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'warm temperate thorn scrub'
-                        elif w.is_humidity_semiarid((x, y)):
-                            biome[y][x] = 'warm temperate dry forest'
-                        elif w.is_humidity_subhumid((x, y)):
-                            biome[y][x] = 'warm temperate moist forest'
-                        elif w.is_humidity_humid((x, y)):
-                            biome[y][x] = 'warm temperate wet forest'
-                        else:
-                            biome[y][x] = 'warm temperate rain forest'
-                    elif w.is_temperature_subtropical((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'subtropical desert'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'subtropical desert scrub'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'subtropical thorn woodland'
-                        elif w.is_humidity_semiarid((x, y)):
-                            biome[y][x] = 'subtropical dry forest'
-                        elif w.is_humidity_subhumid((x, y)):
-                            biome[y][x] = 'subtropical moist forest'
-                        elif w.is_humidity_humid((x, y)):
-                            biome[y][x] = 'subtropical wet forest'
-                        else:
-                            biome[y][x] = 'subtropical rain forest'
-                    elif w.is_temperature_tropical((x, y)):
-                        if w.is_humidity_superarid((x, y)):
-                            biome[y][x] = 'tropical desert'
-                        elif w.is_humidity_perarid((x, y)):
-                            biome[y][x] = 'tropical desert scrub'
-                        elif w.is_humidity_arid((x, y)):
-                            biome[y][x] = 'tropical thorn woodland'
-                        elif w.is_humidity_semiarid((x, y)):
-                            biome[y][x] = 'tropical very dry forest'
-                        elif w.is_humidity_subhumid((x, y)):
-                            biome[y][x] = 'tropical dry forest'
-                        elif w.is_humidity_humid((x, y)):
-                            biome[y][x] = 'tropical moist forest'
-                        elif w.is_humidity_perhumid((x, y)):
-                            biome[y][x] = 'tropical wet forest'
-                        else:
-                            biome[y][x] = 'tropical rain forest'
-                    else:
-                        biome[y][x] = 'bare rock'
-                if not biome[y][x] in biome_cm:
-                    biome_cm[biome[y][x]] = 0
-                biome_cm[biome[y][x]] += 1
-        w.set_biome(biome)
+        land = numpy.logical_not(ocean)
+        temperature = world.temperature_class_map()
+        humidity = world.humidity_class_map()
+
+        table = numpy.array([[biome_name_to_index(name) for name in row]
+                             for row in _BIOMES], dtype=numpy.uint8)
+        biome = table[temperature, humidity]
+        biome[ocean] = biome_name_to_index('ocean')
+        world.set_biome(biome)
+
+        # temperature and humidity classes of the land cells
+        cm = _count(temperature[land], TEMPERATURE_CLASSES)
+        cm.update(_count(humidity[land], HUMIDITY_CLASSES))
+
+        biome_names = [biome_index_to_name(i)
+                       for i in range(int(biome.max()) + 1)]
+        biome_cm = _count(biome, biome_names)
         return (cm, biome_cm)
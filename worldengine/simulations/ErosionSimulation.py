@@ -1,8 +1,12 @@
 from worldengine.simulations.basic import *
+import collections
+import heapq
 import math
 import numpy
 import worldengine.a_star
 from worldengine.common import *
+from worldengine.timing import count
+from worldengine.world import ELEVATION_CLASSES
 
 # Direction
 NORTH = [0, -1]
@@ -18,6 +22,27 @@ CENTER = [0, 0]
 DIR_NEIGHBORS = [NORTH, EAST, SOUTH, WEST]
 DIR_NEIGHBORS_CENTER = [CENTER, NORTH, EAST, SOUTH, WEST]
 
+# ----------------
+# Global variables
+# ----------------
+
+# When it is set, the depressions of the map are filled by priority_flood
+# and the rivers follow the routes found by it
+priority_flood_mode = False
+
+
+def get_priority_flood_mode():
+    return priority_flood_mode
+
+
+def set_priority_flood_mode(value):
+    """
+    Set if the rivers are traced on the depressions filled by
+    priority_flood, instead of searching a lower cell when they get stuck
+    """
+    global priority_flood_mode
+    priority_flood_mode = value
+
 
 def overflow(value, maxValue):
     return value % maxValue
@@ -28,44 +53,216 @@ def in_circle(radius, center_x, center_y, x, y):
     return square_dist <= radius ** 2
 
 
-def _numpy_to_matrix(numpyarray):
-    """Convert a bidimensional numpy array to a plain Python matrix.
-
-    This is used because currently we do not know how to serialize numpy
-    arrays :( with pickle. In the future we will use pytables"""
-
-    width = numpyarray.shape[0]
-    height = numpyarray.shape[1]
-    return [[numpyarray[x, y] for x in xrange(width)] for y in xrange(height)]
+def _downstream(water_path):
+    """Return, for each cell, the index of the cell it flows into following
+    the directions of water_path, or -1. The maps are indexed as [x, y] and
+    the index of a cell is x * height + y."""
+    width, height = water_path.shape
+    moves = numpy.array(DIR_NEIGHBORS_CENTER)
+    xs, ys = numpy.indices((width, height))
+    downstream = (xs + moves[water_path, 0]) * height + ys + \
+        moves[water_path, 1]
+    downstream[water_path == 0] = -1
+    return downstream
+
+
+def _flow_accumulation(water_path, rain_fall, downstream=None):
+    """Return, for each cell, the sum of its rainfall and of the rainfall of
+    all the cells upstream of it, following the directions of water_path
+    (or downstream, see _downstream, when given), and the number of cells
+    flowing directly into it (all indexed [x, y]).
+
+    The cells are visited in a topological order of the flow graph, which
+    is acyclic as water flows only to lower cells: the flow of a cell is
+    passed downstream once all the cells flowing into it have passed theirs.
+    All the cells ready are processed together, each cell only once.
+    """
+    if downstream is None:
+        downstream = _downstream(water_path)
+    width, height = downstream.shape
+    downstream = downstream.ravel()
+    flowing = downstream >= 0
+    flow = numpy.array(rain_fall, dtype=float).ravel()
+    inflows = numpy.bincount(downstream[flowing], minlength=width * height)
+    waiting = inflows.copy()
+    ready = numpy.nonzero(flowing & (waiting == 0))[0]
+    while len(ready) > 0:
+        targets = downstream[ready]
+        numpy.add.at(flow, targets, flow[ready])
+        numpy.subtract.at(waiting, targets, 1)
+        targets = numpy.unique(targets)
+        ready = targets[flowing[targets] & (waiting[targets] == 0)]
+    return flow.reshape(width, height), inflows.reshape(width, height)
+
+
+def _neighbours(x, y, width, height, wrap):
+    """The cells around the given one, in the order of DIR_NEIGHBORS"""
+    for dx, dy in DIR_NEIGHBORS:
+        nx, ny = x + dx, y + dy
+        if wrap:
+            yield nx % width, ny % height
+        elif 0 <= nx < width and 0 <= ny < height:
+            yield nx, ny
+
+
+def priority_flood(elevation, ocean, wrap=True):
+    """Fill the depressions of the map flooding it from the ocean, as the
+    Priority-Flood of Barnes et al. (2014): the cells are reached from the
+    lowest cell already flooded, so the water of each cell spills into the
+    one it was reached from, and a cell lower than it is raised to its
+    level. The cells reached from a filled cell are taken from a plain
+    queue, as they are all at the same level.
+
+    Without ocean the water flows to the lowest cell of the map.
+    :return: for each cell (indexed [x, y]) the index of the cell its water
+             spills into (as in _downstream, -1 for the ocean) and the level
+             of its water, above the elevation in the depressions filled
+    """
+    elevation = numpy.asarray(elevation, dtype=float).T
+    width, height = elevation.shape
+    values = elevation.ravel().tolist()
+    level = list(values)
+    downstream = [-1] * (width * height)
+    flooded = numpy.asarray(ocean, dtype=bool).T.ravel()
+    seeds = numpy.nonzero(flooded)[0].tolist()
+    if not seeds:
+        seeds = [int(numpy.argmin(values))]
+        flooded[seeds[0]] = True
+    flooded = flooded.tolist()
+
+    queue = [(values[i], i) for i in seeds]
+    heapq.heapify(queue)
+    filled = collections.deque()
+    while queue or filled:
+        if filled:
+            i = filled.popleft()
+        else:
+            _, i = heapq.heappop(queue)
+        x, y = divmod(i, height)
+        for nx, ny in _neighbours(x, y, width, height, wrap):
+            n = nx * height + ny
+            if flooded[n]:
+                continue
+            flooded[n] = True
+            downstream[n] = i
+            if values[n] <= level[i]:
+                level[n] = level[i]
+                filled.append(n)
+            else:
+                heapq.heappush(queue, (values[n], n))
+    return (numpy.array(downstream).reshape(width, height),
+            numpy.array(level).reshape(width, height))
+
+
+def _lake_cells(river_list, depth, level, wrap):
+    """Return the cells of the depressions filled (where depth is above
+    0) which the rivers flow through: each depression extends over the
+    cells around at the same level"""
+    width, height = depth.shape
+    lake = numpy.zeros(depth.shape, dtype=bool)
+    for river in river_list:
+        for x, y in river:
+            if lake[x, y] or depth[x, y] <= 0:
+                continue
+            lake[x, y] = True
+            pending = [(x, y)]
+            while pending:
+                cx, cy = pending.pop()
+                for nx, ny in _neighbours(cx, cy, width, height, wrap):
+                    if not lake[nx, ny] and depth[nx, ny] > 0 and \
+                            level[nx, ny] == level[cx, cy]:
+                        lake[nx, ny] = True
+                        pending.append((nx, ny))
+    return lake
+
+
+class RiverIndex(object):
+    """For each cell, the first river passing through it and the position
+    of the cell in that river, so that finding the river to merge into and
+    the part of it downstream of the merge does not need to search the
+    rivers. The rivers have to be added in the order of river_list."""
+
+    def __init__(self, width, height, river_list=()):
+        self.width = width
+        self.height = height
+        # indexed as [x, y], -1 where there is no river
+        self.rivers = -numpy.ones((width, height), dtype=numpy.int32)
+        self.positions = numpy.zeros((width, height), dtype=numpy.int32)
+        for river_id, river in enumerate(river_list):
+            self.add(river_id, river)
+
+    def add(self, river_id, river):
+        for position, (x, y) in enumerate(river):
+            if 0 <= x < self.width and 0 <= y < self.height and \
+                    self.rivers[x, y] < 0:
+                self.rivers[x, y] = river_id
+                self.positions[x, y] = position
+
+    def find(self, x, y):
+        """Return the id of the first river passing through the cell and
+        the position of the cell in it, or None"""
+        if not (0 <= x < self.width and 0 <= y < self.height) or \
+                self.rivers[x, y] < 0:
+            return None
+        return int(self.rivers[x, y]), int(self.positions[x, y])
 
 
 class ErosionSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['elevation', 'ocean', 'precipitation']
+    outputs = ['elevation', 'river_map', 'lake_map']
+
     def __init__(self):
         self.wrap = True
+        self.priority_flood_mode = get_priority_flood_mode()
+        # the searches of the paths reuse their arrays while the elevation
+        # is the same
+        self.path_finder = worldengine.a_star.PathFinder()
 
     def is_applicable(self, world):
-        return world.has_precipitations()
+        return world.has_precipitations() and (not world.has_rivermap())
 
     def execute(self, world, seed):
         water_flow = numpy.zeros((world.width, world.height))
         water_path = numpy.zeros((world.width, world.height), dtype=int)
         river_list = []
+        river_index = RiverIndex(world.width, world.height)
         lake_list = []
         river_map = numpy.zeros((world.width, world.height))
         lake_map = numpy.zeros((world.width, world.height))
 
-        # step one: water flow per cell based on rainfall
-        self.find_water_flow(world, water_path)
+        # step one: water flow per cell based on rainfall, in priority
+        # flood mode the water flows along the spill routes of the
+        # depressions filled
+        if self.priority_flood_mode:
+            downstream, level = priority_flood(world.elevation['data'],
+                                               world.ocean, self.wrap)
+            depth = level - numpy.asarray(world.elevation['data']).T
+        else:
+            downstream = None
+            self.find_water_flow(world, water_path)
 
         # step two: find river sources (seeds)
-        river_sources = self.river_sources(world, water_flow, water_path)
+        river_sources = self.river_sources(world, water_flow, water_path,
+                                           downstream)
 
         # step three: for each source, find a path to sea
         for source in river_sources:
-            river = self.river_flow(source, world, river_list, lake_list)
+            if downstream is None:
+                river = self.river_flow(source, world, river_list,
+                                        lake_list, river_index)
+            else:
+                river = self.river_flow_downstream(source, world, river_list,
+                                                   river_index, downstream)
             if len(river) > 0:
+                river_index.add(len(river_list), river)
                 river_list.append(river)
-                self.cleanUpFlow(river, world)
+                if downstream is None:
+                    self.cleanUpFlow(river, world)
+                else:
+                    # the filled depressions are not carved
+                    self.cleanUpFlow([[x, y] for x, y in river
+                                      if depth[x, y] <= 0], world)
                 rx, ry = river[-1]  # find last cell in river
                 if not world.is_ocean((rx, ry)):
                     lake_list.append(river[-1])  # river flowed into a lake
@@ -81,26 +278,51 @@ class ErosionSimulation(object):
             # print "Found lake at:",lake
             lx, ly = lake
             lake_map[lx, ly] = 0.1  # TODO: make this based on rainfall/flow
+        if downstream is not None:
+            # the depressions the rivers flow through are lakes, the lake map
+            # has the depth of their water
+            lakes = _lake_cells(river_list, depth, level, self.wrap)
+            lake_map[lakes] = depth[lakes]
+
+        # the elevation has been changed in place by the erosion: set it again
+        # so that the values calculated on it are not reused
+        world.set_elevation(world.elevation['data'],
+                            world.elevation['thresholds'])
 
-        world.set_rivermap(_numpy_to_matrix(river_map))
-        world.set_lakemap(_numpy_to_matrix(lake_map))
+        # the maps used here are indexed as [x, y]
+        world.set_rivermap(river_map.T)
+        world.set_lakemap(lake_map.T)
 
     def find_water_flow(self, world, water_path):
-        """Find the flow direction for each cell in heightmap"""
-
-        # iterate through each cell
-        for x in range(world.width - 1):
-            for y in range(world.height - 1):
-                # search around cell for a direction
-                path = self.find_quick_path([x, y], world)
-                if path:
-                    tx, ty = path
-                    flowDir = [tx - x, ty - y]
-                    key = 0
-                    for direction in DIR_NEIGHBORS_CENTER:
-                        if direction == flowDir:
-                            water_path[x, y] = key
-                        key += 1
+        """Find the flow direction for each cell in heightmap: the index in
+        DIR_NEIGHBORS_CENTER of its lowest neighbour (the first one, if more
+        are equally low), when it is lower than the cell. The direction is 0
+        when no neighbour is lower, or when the lowest one is across the
+        border of the map (water_path is followed without wrapping)."""
+        elevation = numpy.asarray(world.elevation['data'])
+        height, width = elevation.shape
+        lowest = elevation
+        direction = numpy.zeros(elevation.shape, dtype=int)
+        across = numpy.zeros(elevation.shape, dtype=bool)
+        for key, (dx, dy) in enumerate(DIR_NEIGHBORS_CENTER):
+            if key == 0:
+                continue
+            # elevation of the neighbour in this direction, wrapping around
+            neighbour = numpy.roll(numpy.roll(elevation, -dy, axis=0), -dx,
+                                   axis=1)
+            border = numpy.zeros(elevation.shape, dtype=bool)
+            if dy != 0:
+                border[0 if dy < 0 else height - 1, :] = True
+            if dx != 0:
+                border[:, 0 if dx < 0 else width - 1] = True
+            lower = neighbour < lowest
+            if not self.wrap:
+                lower &= ~border
+            lowest = numpy.where(lower, neighbour, lowest)
+            direction[lower] = key
+            across[lower] = border[lower]
+        direction[across] = 0
+        water_path[:, :] = direction.T
 
     def find_quick_path(self, river, world):
         # Water flows based on cost, seeking the highest elevation difference
@@ -134,88 +356,71 @@ class ErosionSimulation(object):
 
         return new_path
 
-    def river_sources(self, world, waterFlow, waterPath):
-        """Find places on map where sources of river can be found"""
-        river_source_list = []
-
+    def river_sources(self, world, waterFlow, waterPath, downstream=None):
+        """Find places on map where sources of river can be found. When
+        downstream is given (see _downstream) water flows following it
+        instead of waterPath"""
         RIVER_TH = 0.02
+        SEED_DISTANCE = 9
 
         # Using the wind and rainfall data, create river 'seeds' by
         #     flowing rainfall along paths until a 'flow' threshold is reached
         #     and we have a beginning of a river... trickle->stream->river->sea
 
-        # step one: Using flow direction, follow the path for each cell
-        #     adding the previous cell's flow to the current cell's flow.
-        # step two: We loop through the water flow map looking for cells
-        #     above the water flow threshold. These are our river sources and
-        #     we mark them as rivers. While looking, the cells with no
-        #     out-going flow, above water flow threshold and are still
-        #     above sea level are marked as 'sources'.
-        for x in range(0, world.width - 1):
-            for y in range(0, world.height - 1):
-                rain_fall = world.precipitation['data'][y][x]
-                waterFlow[x, y] = rain_fall
-
-                if waterPath[x, y] == 0:
-                    continue  # ignore cells without flow direction
-                cx, cy = x, y  # begin with starting location
-                neighbour_seed_found = False
-                # follow flow path to where it may lead
-                while not neighbour_seed_found:
-
-                    # have we found a seed?
-                    if world.is_mountain((cx, cy)) and\
-                                    waterFlow[cx, cy] >= RIVER_TH:
-
-                        # try not to create seeds around other seeds
-                        for seed in river_source_list:
-                            sx, sy = seed
-                            if in_circle(9, cx, cy, sx, sy):
-                                neighbour_seed_found = True
-                        if neighbour_seed_found:
-                            break  # we do not want seeds for neighbors
-
-                        river_source_list.append([cx, cy])  # river seed
-                        break
-
-                    # no path means dead end...
-                    if waterPath[cx, cy] == 0:
-                        break  # break out of loop
-
-                    # follow path, add water flow from previous cell
-                    dx, dy = DIR_NEIGHBORS_CENTER[waterPath[cx, cy]]
-                    nx, ny = cx + dx, cy + dy  # calculate next cell
-                    waterFlow[nx, ny] += rain_fall
-                    cx, cy = nx, ny  # set current cell to next cell
+        # step one: Using flow direction, add to the flow of each cell its
+        #     rainfall and the flow of all the cells flowing into it.
+        # step two: the mountain cells with a flow above the threshold are
+        #     river seeds, unless there is already a seed near them. The
+        #     cells are considered column by column, ignoring the ones
+        #     without flow (no flow direction and nothing flowing in).
+        rain_fall = numpy.asarray(world.precipitation['data']).T
+        if downstream is None:
+            downstream = _downstream(waterPath)
+        flow, inflows = _flow_accumulation(waterPath, rain_fall, downstream)
+        waterFlow[:, :] = flow
+        mountain = world.elevation_class_map().T == \
+            ELEVATION_CLASSES.index('mountain')
+        candidates = mountain & (flow >= RIVER_TH) & \
+            ((downstream >= 0) | (inflows > 0))
+
+        # the seeds are kept in a grid of SEED_DISTANCE sized buckets: only
+        # the seeds in the buckets around a cell can be near it
+        river_source_list = []
+        buckets = {}
+        for x, y in zip(*numpy.nonzero(candidates)):
+            x, y = int(x), int(y)
+            bx, by = x // SEED_DISTANCE, y // SEED_DISTANCE
+            # try not to create seeds around other seeds
+            if any(in_circle(SEED_DISTANCE, x, y, sx, sy)
+                   for nbx in (bx - 1, bx, bx + 1)
+                   for nby in (by - 1, by, by + 1)
+                   for sx, sy in buckets.get((nbx, nby), [])):
+                continue
+            buckets.setdefault((bx, by), []).append((x, y))
+            river_source_list.append([x, y])  # river seed
         return river_source_list
 
-    def river_flow(self, source, world, river_list, lake_list):
+    def river_flow(self, source, world, river_list, lake_list,
+                   river_index=None):
         """simulate fluid dynamics by using starting point and flowing to the
-        lowest available point"""
+        lowest available point. river_index has to index the rivers of
+        river_list, when not given it is built"""
+        if river_index is None:
+            river_index = RiverIndex(world.width, world.height, river_list)
         current_location = source
         path = [source]
+        steps = 0
 
         # start the flow
         while True:
             x, y = current_location
+            steps += 1
 
             # is there a river nearby, flow into it
-            for dx, dy in DIR_NEIGHBORS:
-                ax, ay = x + dx, y + dy
-                if self.wrap:
-                    ax, ay = overflow(ax, world.width), overflow(ay,
-                                                                 world.height)
-
-                for river in river_list:
-                    if [ax, ay] in river:
-                        merge = False
-                        for rx, ry in river:
-                            if [ax, ay] == [rx, ry]:
-                                merge = True
-                                path.append([rx, ry])
-                            elif merge:
-                                path.append([rx, ry])
-                        return path  # skip the rest, return path
+            if self._merge(x, y, world, river_list, river_index, path):
+                count('river_flow.steps', steps)
+                count('river_flow.merges')
+                return path  # skip the rest, return path
 
             # found a sea?
             if world.is_ocean((x, y)):
@@ -232,7 +437,7 @@ class ErosionSimulation(object):
             is_wrapped, lower_elevation = self.findLowerElevation(
                 current_location, world)
             if lower_elevation and not is_wrapped:
-                lower_path = worldengine.a_star.PathFinder().find(
+                lower_path = self.path_finder.find(
                     world.elevation['data'], current_location, lower_elevation)
                 if lower_path:
                     path += lower_path
@@ -276,29 +481,69 @@ class ErosionSimulation(object):
 
                 # find our way to the edge
                 edgePath = None
-                edgePath = worldengine.a_star.PathFinder().find(
+                edgePath = self.path_finder.find(
                     world.elevation['data'], [cx, cy], [lx, ly])
                 if not edgePath:
                     # can't find another other path, make it a lake
                     lake_list.append(current_location)
+                    count('river_flow.lakes')
                     break
                 path += edgePath  # add our newly found path
                 path.append([nx, ny])  # finally add our overflow to other side
                 current_location = path[-1]
 
                 # find our way to lowest position original found
-                lower_path = worldengine.a_star.PathFinder().find(
+                lower_path = self.path_finder.find(
                     world.elevation['data'], current_location, lower_elevation)
                 path += lower_path
                 current_location = path[-1]
 
             else:  # can't find any other path, make it a lake
                 lake_list.append(current_location)
+                count('river_flow.lakes')
                 break  # end of river
 
             if not world.contains(current_location):
                 print("Why are we here:", current_location)
 
+        count('river_flow.steps', steps)
+        return path
+
+    def _merge(self, x, y, world, river_list, river_index, path):
+        """If there is a river next to the cell, add to path the part of it
+        from there, downstream. Return if the path has been merged."""
+        for dx, dy in DIR_NEIGHBORS:
+            ax, ay = x + dx, y + dy
+            if self.wrap:
+                ax, ay = overflow(ax, world.width), overflow(ay,
+                                                             world.height)
+
+            found = river_index.find(ax, ay)
+            if found is not None:
+                # follow the river from there
+                river_id, position = found
+                path += [[rx, ry] for rx, ry in
+                         river_list[river_id][position:]]
+                return True
+        return False
+
+    def river_flow_downstream(self, source, world, river_list, river_index,
+                              downstream):
+        """Flow from the starting point following downstream (see
+        priority_flood) until the sea or another river"""
+        path = [source]
+        x, y = source
+        steps = 0
+        while True:
+            steps += 1
+            if self._merge(x, y, world, river_list, river_index, path):
+                count('river_flow.merges')
+                break
+            if world.is_ocean((x, y)) or downstream[x, y] < 0:
+                break
+            x, y = divmod(int(downstream[x, y]), world.height)
+            path.append([x, y])
+        count('river_flow.steps', steps)
         return path
 
     def cleanUpFlow(self, river, world):
@@ -356,6 +601,7 @@ class ErosionSimulation(object):
 
             currentRadius += 1
 
+        count('find_lower_elevation.radius_expansions', currentRadius - 2)
         if destination in wrapped:
             isWrapped = True
         # print "Wrapped lower elevation found:", rx, ry, "!"
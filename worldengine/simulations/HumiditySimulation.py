@@ -2,39 +2,27 @@ from worldengine.simulations.basic import *
 
 
 class HumiditySimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['ocean', 'precipitation', 'irrigation']
+    outputs = ['humidity']
 
     def is_applicable(self, world):
         return world.has_precipitations() and world.has_irrigation() and (
             not world.has_humidity())
 
     def execute(self, world, seed):
-        world.humidity = self._calculate(world)
+        data, quantiles = self._calculate(world)
+        world.set_humidity(data, quantiles)
 
     def _calculate(self, world):
         humidity = {}
-        humidity['data'] = [[0 for x in xrange(world.width)] for y in
-                            xrange(world.height)]
-
-        for y in xrange(world.height):
-            for x in xrange(world.width):
-                humidity['data'][y][x] = world.precipitation['data'][y][x] + \
-                                         world.irrigation[y][x]
+        humidity['data'] = world.precipitation['data'] + world.irrigation
 
         # These were originally evenly spaced at 12.5% each but changing them
         # to a bell curve produced better results
-        humidity['quantiles'] = {}
-        humidity['quantiles']['12'] = find_threshold_f(humidity['data'], 0.02,
-                                                       world.ocean)
-        humidity['quantiles']['25'] = find_threshold_f(humidity['data'], 0.09,
-                                                       world.ocean)
-        humidity['quantiles']['37'] = find_threshold_f(humidity['data'], 0.26,
-                                                       world.ocean)
-        humidity['quantiles']['50'] = find_threshold_f(humidity['data'], 0.50,
-                                                       world.ocean)
-        humidity['quantiles']['62'] = find_threshold_f(humidity['data'], 0.74,
-                                                       world.ocean)
-        humidity['quantiles']['75'] = find_threshold_f(humidity['data'], 0.91,
-                                                       world.ocean)
-        humidity['quantiles']['87'] = find_threshold_f(humidity['data'], 0.98,
-                                                       world.ocean)
-        return humidity
+        keys = ['12', '25', '37', '50', '62', '75', '87']
+        ths = find_thresholds(humidity['data'],
+                              [0.02, 0.09, 0.26, 0.50, 0.74, 0.91, 0.98],
+                              world.ocean)
+        humidity['quantiles'] = dict(zip(keys, ths))
+        return humidity['data'], humidity['quantiles']
@@ -3,12 +3,15 @@ import math
 
 
 class IrrigationSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['ocean', 'watermap']
+    outputs = ['irrigation']
 
     def is_applicable(self, world):
         return world.has_watermap() and (not world.has_irrigation())
 
     def execute(self, world, seed):
-        world.irrigation = self._calculate(world)
+        world.set_irrigation(self._calculate(world))
 
     def _calculate(self, world):
         width = world.width
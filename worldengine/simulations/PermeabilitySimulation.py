@@ -1,35 +1,34 @@
 from worldengine.simulations.basic import *
 import random
+import numpy
+
+from worldengine.noise_field import noise_map
 
 
 class PermeabilitySimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['ocean']
+    outputs = ['permeability']
+
     def is_applicable(self, world):
         return not world.has_permeability()
 
     def execute(self, world, seed):
         perm = self._calculate(seed, world.width, world.height)
+        low, med = find_thresholds(perm, [0.75, 0.25], world.ocean)
         perm_th = [
-            ('low', find_threshold_f(perm, 0.75, world.ocean)),
-            ('med', find_threshold_f(perm, 0.25, world.ocean)),
+            ('low', low),
+            ('med', med),
             ('hig', None)
         ]
         world.set_permeability(perm, perm_th)
 
     def _calculate(self, seed, width, height):
-        random.seed(seed * 37)
-        base = random.randint(0, 4096)
-        perm = [[0 for x in xrange(width)] for y in xrange(height)]
-
-        from noise import snoise2
+        # a random generator of its own, the global one could be used at
+        # the same time by other simulations
+        base = random.Random(seed * 37).randint(0, 4096)
 
         octaves = 6
         freq = 64.0 * octaves
-
-        for y in range(0, height):
-            yscaled = float(y) / height
-            for x in range(0, width):
-                n = snoise2(x / freq, y / freq, octaves, base=base)
-                t = n
-                perm[y][x] = t
-
-        return perm
+        # a copy, the noise map can be read-only
+        return numpy.array(noise_map(width, height, freq, octaves, base))
@@ -1,56 +1,47 @@
 import random
-import time
-from noise import snoise2
+import numpy
 
 from worldengine.simulations.basic import *
 from worldengine.common import *
+from worldengine.noise_field import wrapped_noise_map
 
 
 class PrecipitationSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['ocean']
+    outputs = ['precipitation']
 
     def is_applicable(self, world):
         return not world.has_precipitations()
 
     def execute(self, world, seed):
-        if get_verbose():
-            start_time = time.time()
         prec = self._calculate(seed, world.width, world.height)
+        low, med = find_thresholds(prec, [0.75, 0.3], world.ocean)
         ths = [
-            ('low', find_threshold_f(prec, 0.75, world.ocean)),
-            ('med', find_threshold_f(prec, 0.3, world.ocean)),
+            ('low', low),
+            ('med', med),
             ('hig', None)
         ]
         world.set_precipitation(prec, ths)
-        if get_verbose():
-            elapsed_time = time.time() - start_time
-            print(
-                "...precipitations calculated. Elapsed time %f  seconds."
-                % elapsed_time)
 
     def _calculate(self, seed, width, height):
         """Precipitation is a value in [-1,1]"""
-        border = width / 4
-        random.seed(seed * 13)
-        base = random.randint(0, 4096)
-        precipitations = [[0 for x in range(width)] for y in range(height)]
-
+        # a random generator of its own, the global one could be used at
+        # the same time by other simulations
+        base = random.Random(seed * 13).randint(0, 4096)
         octaves = 6
         freq = 64.0 * octaves
 
-        for y in range(height):
-            yscaled = float(y) / height
-            latitude_factor = 1.0 - (abs(yscaled - 0.5) * 2)
-            for x in range(width):
-                n = snoise2(x / freq, y / freq, octaves, base=base)
-
-                # Added to allow noise pattern to wrap around right and left.
-                if x < border:
-                    n = (snoise2(x / freq, y / freq, octaves,
-                                 base=base) * x / border) + (
-                            snoise2((x + width) / freq, y / freq, octaves,
-                                    base=base) * (border - x) / border)
+        # The noise pattern wraps around right and left
+        n = wrapped_noise_map(width, height, freq, octaves, base)
 
-                prec = (latitude_factor + n * 4) / 5.0
-                precipitations[y][x] = prec
+        precipitations = numpy.empty((height, width))
 
+        def calculate_band(y_start, y_end):
+            yscaled = numpy.arange(y_start, y_end) / float(height)
+            latitude_factor = 1.0 - (numpy.abs(yscaled - 0.5) * 2)
+            precipitations[y_start:y_end] = (
+                latitude_factor[:, numpy.newaxis] +
+                n[y_start:y_end] * 4) / 5.0
+        for_each_band(height, calculate_band)
         return precipitations
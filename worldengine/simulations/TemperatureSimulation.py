@@ -1,8 +1,15 @@
 from worldengine.simulations.basic import *
 import random
+import numpy
+
+from worldengine.common import for_each_band
+from worldengine.noise_field import wrapped_noise_map
 
 
 class TemperatureSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['elevation', 'ocean']
+    outputs = ['temperature']
 
     def is_applicable(self, world):
         return not world.has_temperature()
@@ -13,13 +20,15 @@ class TemperatureSimulation(object):
         ocean = world.ocean
 
         t = self._calculate(world, seed, e, ml)
+        polar, alpine, boreal, cool, warm, subtropical = find_thresholds(
+            t, [0.90, 0.76, 0.59, 0.38, 0.26, 0.14], ocean)
         t_th = [
-            ('polar', find_threshold_f(t, 0.90, ocean)),
-            ('alpine', find_threshold_f(t, 0.76, ocean)),
-            ('boreal', find_threshold_f(t, 0.59, ocean)),
-            ('cool', find_threshold_f(t, 0.38, ocean)),
-            ('warm', find_threshold_f(t, 0.26, ocean)),
-            ('subtropical', find_threshold_f(t, 0.14, ocean)),
+            ('polar', polar),
+            ('alpine', alpine),
+            ('boreal', boreal),
+            ('cool', cool),
+            ('warm', warm),
+            ('subtropical', subtropical),
             ('tropical', None)
         ]
         world.set_temperature(t, t_th)
@@ -28,37 +37,30 @@ class TemperatureSimulation(object):
         width = world.width
         height = world.height
 
-        random.seed(seed * 7)
-        base = random.randint(0, 4096)
-        temp = [[0 for x in xrange(width)] for y in xrange(height)]
-
-        from noise import snoise2
+        # a random generator of its own, the global one could be used at
+        # the same time by other simulations
+        base = random.Random(seed * 7).randint(0, 4096)
 
-        border = width / 4
         octaves = 6
         freq = 16.0 * octaves
 
-        for y in range(0, height):
-            yscaled = float(y) / height
-            latitude_factor = 1.0 - (abs(yscaled - 0.5) * 2)
-            for x in range(0, width):
-                n = snoise2(x / freq, y / freq, octaves, base=base)
-
-                # Added to allow noise pattern to wrap around right and left.
-                if x <= border:
-                    n = (snoise2(x / freq, y / freq, octaves,
-                                 base=base) * x / border) \
-                        + (snoise2((x + width) / freq, y / freq, octaves,
-                                   base=base) * (border - x) / border)
+        # The noise pattern wraps around right and left
+        n = wrapped_noise_map(width, height, freq, octaves, base)
 
-                t = (latitude_factor * 3 + n * 2) / 5.0
-                if elevation[y][x] > mountain_level:
-                    if elevation[y][x] > (mountain_level + 29):
-                        altitude_factor = 0.033
-                    else:
-                        altitude_factor = 1.00 - (
-                            float(elevation[y][x] - mountain_level) / 30)
-                    t *= altitude_factor
-                temp[y][x] = t
+        elevation = numpy.asarray(elevation)
+        temp = numpy.empty((height, width))
 
+        def calculate_band(y_start, y_end):
+            yscaled = numpy.arange(y_start, y_end) / float(height)
+            latitude_factor = 1.0 - (numpy.abs(yscaled - 0.5) * 2)
+            t = (latitude_factor[:, numpy.newaxis] * 3 +
+                 n[y_start:y_end] * 2) / 5.0
+            e = elevation[y_start:y_end]
+            altitude_factor = numpy.where(
+                e > (mountain_level + 29), 0.033,
+                1.00 - (e - mountain_level) / 30.0)
+            mountains = e > mountain_level
+            t[mountains] *= altitude_factor[mountains]
+            temp[y_start:y_end] = t
+        for_each_band(height, calculate_band)
         return temp
@@ -1,18 +1,35 @@
+import random
+
 from worldengine.simulations.basic import *
+from worldengine.timing import count, count_max
 
 
 class WatermapSimulation(object):
+    # layers read and written, see worldengine.scheduler
+    inputs = ['elevation', 'ocean', 'precipitation']
+    outputs = ['watermap']
 
     def is_applicable(self, world):
         return world.has_precipitations() and (not world.has_watermap())
 
     def execute(self, world, seed):
-        world.watermap = self._watermap(world, 20000)
+        # the droplets fall where they did when this simulation used the
+        # global random generator, seeded by PrecipitationSimulation just
+        # before
+        rng = random.Random(seed * 13)
+        rng.randint(0, 4096)
+        data, thresholds = self._watermap(world, 20000, rng)
+        world.set_watermap(data, thresholds)
+
+    def _watermap(self, world, n, rng=random):
+        # deepest recursion reached by the droplets
+        max_depth = [0]
 
-    def _watermap(self, world, n):
-        def droplet(world, pos, q, _watermap):
+        def droplet(world, pos, q, _watermap, depth=1):
             if q < 0:
                 return
+            if depth > max_depth[0]:
+                max_depth[0] = depth
             x, y = pos
             pos_elev = world.elevation['data'][y][x] + _watermap[y][x]
             lowers = []
@@ -47,25 +64,25 @@ class WatermapSimulation(object):
                         going = ql > 0.05
                         _watermap[py][px] += ql
                         if going:
-                            droplet(world, p, ql, _watermap)
+                            droplet(world, p, ql, _watermap, depth + 1)
             else:
                 _watermap[y][x] += q
 
         _watermap_data = [[0 for x in xrange(world.width)] for y in
                           xrange(world.height)]
+        droplets = 0
         for i in xrange(n):
-            x, y = world.random_land()
+            x, y = world.random_land(rng)
             if True and world.precipitation['data'][y][x] > 0:
                 droplet(world, (x, y), world.precipitation['data'][y][x],
                         _watermap_data)
-        _watermap = {'data': _watermap_data}
-        _watermap['thresholds'] = {}
-        _watermap['thresholds']['creek'] = find_threshold_f(_watermap_data,
-                                                            0.05,
-                                                            ocean=world.ocean)
-        _watermap['thresholds']['river'] = find_threshold_f(_watermap_data,
-                                                            0.02,
-                                                            ocean=world.ocean)
-        _watermap['thresholds']['main river'] = \
-            find_threshold_f(_watermap_data, 0.007, ocean=world.ocean)
-        return _watermap
+                droplets += 1
+        count('watermap.droplets', droplets)
+        count_max('watermap.max_depth', max_depth[0])
+        creek, river, main_river = find_thresholds(
+            _watermap_data, [0.05, 0.02, 0.007], ocean=world.ocean)
+        _thresholds = {}
+        _thresholds['creek'] = creek
+        _thresholds['river'] = river
+        _thresholds['main river'] = main_river
+        return _watermap_data, _thresholds
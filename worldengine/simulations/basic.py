@@ -1,88 +1,170 @@
-def find_threshold(elevation, land_perc, ocean=None):
-    width = len(elevation[0])
-    height = len(elevation)
-
-    def count(e):
-        tot = 0
-        for y in range(0, height):
-            for x in range(0, width):
-                if elevation[y][x] > e and (ocean is None or not ocean[y][x]):
-                    tot += 1
-        return tot
-
-    def search(a, b, desired):
-        if (not type(a) == int) or (not type(b) == int):
-            raise "A and B should be int"
-        if a == b:
-            return a
-        if (b - a) == 1:
-            ca = count(a)
-            cb = count(b)
-            dista = abs(desired - ca)
-            distb = abs(desired - cb)
-            if dista < distb:
-                return a
-            else:
-                return b
-        m = int((a + b) / 2)
-        cm = count(m)
-        if desired < cm:
-            return search(m, b, desired)
+import math
+import numpy
+
+from worldengine.timing import span, count
+
+# ----------------
+# Global variables
+# ----------------
+
+# When it is set, thresholds are approximated by reading the layers band by
+# band (see _approximate_thresholds) instead of being calculated exactly
+thresholds_error = None
+
+
+def get_thresholds_error():
+    return thresholds_error
+
+
+def set_thresholds_error(value):
+    """
+    Set the maximum error of the thresholds, as a fraction of the range of
+    values of the layer. None means that thresholds are calculated exactly.
+    """
+    global thresholds_error
+    if value is not None and not 0.0 < value < 1.0:
+        raise Exception("The thresholds error should be in (0, 1)")
+    thresholds_error = value
+
+
+def _land_values(data, ocean):
+    """Return a flat array with the values of the land cells: the cells
+    where ocean is True are not considered"""
+    data = numpy.asarray(data)
+    if ocean is None:
+        return data.ravel()
+    ocean = numpy.asarray(ocean, dtype=bool)
+    if data.shape != ocean.shape:
+        raise Exception(
+            "Dimension of data and ocean do not match. " +
+            "Data is %d x %d, while ocean is %d x %d" % (
+                data.shape[1], data.shape[0], ocean.shape[1],
+                ocean.shape[0]))
+    values = data[numpy.logical_not(ocean)]
+    if len(values) == 0:
+        # there is no land: use all the cells
+        return data.ravel()
+    return values
+
+
+def find_thresholds(data, land_percs, ocean=None):
+    """Find, for each of the given percentages, the value which is exceeded
+    by that percentage of the land cells.
+
+    The land cells are selected and partitioned only once, whatever the
+    number of percentages requested. Each threshold is halfway between the
+    last value not exceeding it and the first value exceeding it.
+    If an error is set through set_thresholds_error the thresholds are
+    approximated instead, using a bounded amount of memory.
+    :return: a list with a threshold for each percentage
+    """
+    with span('thresholds', verbose=False, percentages=len(land_percs)):
+        if get_thresholds_error() is not None:
+            return _approximate_thresholds(data, land_percs, ocean,
+                                           get_thresholds_error())
+        return _exact_thresholds(data, land_percs, ocean)
+
+
+def _exact_thresholds(data, land_percs, ocean):
+    values = _land_values(data, ocean)
+    n = len(values)
+    count('thresholds.values', n)
+    bounds = []
+    for land_perc in land_percs:
+        above = int(round(n * land_perc))
+        lower = min(max(n - above - 1, 0), n - 1)
+        upper = min(n - above, n - 1)
+        bounds.append((lower, upper))
+
+    kth = sorted(set([i for b in bounds for i in b]))
+    values = numpy.partition(values, kth)
+    return [float(values[lower] + values[upper]) / 2.0
+            for lower, upper in bounds]
+
+
+def _bands(data, ocean, band_height):
+    """Yield the values of the land cells, a band of rows at a time"""
+    for y in range(0, len(data), band_height):
+        band = numpy.asarray(data[y:y + band_height])
+        if ocean is None:
+            yield band.ravel()
         else:
-            return search(a, m, desired)
+            yield band[numpy.logical_not(ocean[y:y + band_height])]
+
+
+def _approximate_thresholds(data, land_percs, ocean, error,
+                            band_height=256):
+    """Approximate find_thresholds reading the layer a band of rows at a
+    time, so that no copy of the whole layer is needed.
+
+    A first pass finds the range of the values, a second one builds an
+    histogram of the values with 1 / error bins. Each threshold is then
+    interpolated within its bin, so it is wrong at most by error times the
+    range of the values.
+    """
+    if ocean is not None and len(data) != len(ocean):
+        raise Exception("Dimension of data and ocean do not match")
+    n = 0
+    low = None
+    high = None
+    for values in _bands(data, ocean, band_height):
+        if len(values) > 0:
+            n += len(values)
+            low = values.min() if low is None else min(low, values.min())
+            high = values.max() if high is None else max(high, values.max())
+    if n == 0:
+        if ocean is None:
+            raise Exception("The layer is empty")
+        # there is no land: use all the cells
+        return _approximate_thresholds(data, land_percs, None, error,
+                                       band_height)
+    count('thresholds.values', n)
+    if low == high:
+        return [float(low)] * len(land_percs)
+
+    n_bins = int(math.ceil(1.0 / error))
+    counts = numpy.zeros(n_bins, dtype=numpy.int64)
+    for values in _bands(data, ocean, band_height):
+        counts += numpy.histogram(values, bins=n_bins, range=(low, high))[0]
+    edges = numpy.linspace(low, high, n_bins + 1)
+    # number of values in the bins above each bin
+    above_bin = counts[::-1].cumsum()[::-1] - counts
 
-    all_land = width * height
-    if ocean:
-        for y in range(0, height):
-            for x in range(0, width):
-                if ocean[y][x]:
-                    all_land -= 1
-    desired_land = all_land * land_perc
-    return search(0, 255, desired_land)
+    ths = []
+    for land_perc in land_percs:
+        above = int(round(n * land_perc))
+        if above <= 0:
+            ths.append(float(high))
+            continue
+        if above >= n:
+            ths.append(float(low))
+            continue
+        # the threshold falls in the last bin having enough values above
+        # its lower edge, values are supposed uniform within a bin
+        i = numpy.nonzero(above_bin + counts >= above)[0][-1]
+        f = float(above - above_bin[i]) / counts[i]
+        ths.append(float(edges[i + 1] - f * (edges[i + 1] - edges[i])))
+    return ths
+
+
+def find_integer_thresholds(data, land_percs, ocean=None):
+    """Find, for each of the given percentages, the integer in [0, 255]
+    which is exceeded by the number of land cells nearest to that
+    percentage.
+
+    :return: a list with a threshold for each percentage
+    """
+    values = numpy.sort(_land_values(data, ocean))
+    candidates = numpy.arange(256)
+    above = len(values) - numpy.searchsorted(values, candidates, side='right')
+    return [int(candidates[numpy.argmin(numpy.abs(len(values) * land_perc -
+                                                  above))])
+            for land_perc in land_percs]
+
+
+def find_threshold(elevation, land_perc, ocean=None):
+    return find_integer_thresholds(elevation, [land_perc], ocean)[0]
 
 
 def find_threshold_f(elevation, land_perc, ocean=None):
-    width = len(elevation[0])
-    height = len(elevation)
-    if ocean:
-        if (width != len(ocean[0])) or (height != len(ocean)):
-            raise Exception(
-                "Dimension of elevation and ocean do not match. " +
-                "Elevation is %d x %d, while ocean is %d x%d" % (
-                    width, height, len(ocean[0]), len(ocean)))
-
-    def count(e):
-        tot = 0
-        for y in range(0, height):
-            for x in range(0, width):
-                if elevation[y][x] > e and (ocean is None or not ocean[y][x]):
-                    tot += 1
-        return tot
-
-    def search(a, b, desired):
-        if a == b:
-            return a
-        if abs(b - a) < 0.005:
-            ca = count(a)
-            cb = count(b)
-            dista = abs(desired - ca)
-            distb = abs(desired - cb)
-            if dista < distb:
-                return a
-            else:
-                return b
-        m = (a + b) / 2.0
-        cm = count(m)
-        if desired < cm:
-            return search(m, b, desired)
-        else:
-            return search(a, m, desired)
-
-    all_land = width * height
-    if ocean:
-        for y in range(0, height):
-            for x in range(0, width):
-                if ocean[y][x]:
-                    all_land -= 1
-    desired_land = all_land * land_perc
-    return search(-1000.0, 1000.0, desired_land)
+    return find_thresholds(elevation, [land_perc], ocean)[0]
@@ -0,0 +1,309 @@
+"""
+Timing of the generation of a world.
+
+The time spent is measured by spans: named intervals which can be nested,
+so that the span of a stage contains the spans of its sub-stages. When a
+span ends it is passed to the listeners registered with add_listener. A
+Recorder is a listener keeping the spans, to summarize them or to write
+them in the Chrome trace-event format (which can be opened in
+chrome://tracing).
+
+The algorithms can also count what they do (see count and count_max): the
+counters are kept by the innermost span and reported with its time.
+
+When verbose the time of the spans is printed as they end.
+
+The spans of the stages (the ones opened with stage=True) can be profiled
+with cProfile, see set_profile, and the peak of the memory used during each
+of them can be recorded, see set_memory_sampling.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from worldengine.common import get_verbose
+from worldengine.memory import Sampler
+
+_local = threading.local()
+
+# Names of the stages to profile ('all' for every stage) and the prefix of
+# the files where their profiles are written
+profile_stages = None
+profile_prefix = None
+# Sampler of the memory used during the stages, if any
+memory_sampler = None
+
+
+class Span(object):
+
+    def __init__(self, name, parent, verbose, attributes):
+        self.name = name
+        self.parent = parent
+        self.verbose = verbose
+        self.attributes = attributes
+        self.children = []
+        self.counters = {}
+        self.maxima = {}
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        end = self.end if self.end is not None else time.time()
+        return end - self.start
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    """Return the innermost span open in this thread, or None"""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def count(name, n=1):
+    """Add n to a counter of the innermost span open in this thread. In hot
+    loops count locally and call this once at the end."""
+    s = current_span()
+    if s is not None:
+        s.counters[name] = s.counters.get(name, 0) + n
+
+
+def count_max(name, value):
+    """Keep the maximum value given for name in the innermost span open in
+    this thread"""
+    s = current_span()
+    if s is not None and (name not in s.maxima or value > s.maxima[name]):
+        s.maxima[name] = value
+
+
+def _metrics(s):
+    metrics = dict(s.counters)
+    metrics.update(s.maxima)
+    return metrics
+
+
+def _print_span(s):
+    if s.verbose:
+        metrics = _metrics(s)
+        print("...%s complete. Elapsed time %f seconds.%s" % (
+            s.name, s.duration, "".join(" %s=%s" % (k, metrics[k])
+                                        for k in sorted(metrics))))
+
+
+_listeners = [_print_span]
+
+
+def get_profile():
+    return profile_stages, profile_prefix
+
+
+def set_profile(stages, prefix=None):
+    """
+    Profile the given stages (or every stage, if they include 'all'): the
+    profile of each stage is written in <prefix>_<stage>.prof. No stage is
+    profiled when stages is empty or None.
+    """
+    global profile_stages, profile_prefix
+    if stages and prefix is None:
+        raise Exception("A prefix is needed to write the profiles")
+    profile_stages = frozenset(stages) if stages else None
+    profile_prefix = prefix
+
+
+def get_memory_sampling():
+    return memory_sampler is not None
+
+
+def set_memory_sampling(interval):
+    """
+    Sample the memory used by the process every interval seconds, recording
+    the peak reached during each stage (and how much it exceeds the memory
+    used when the stage started) as memory.peak_rss and
+    memory.peak_increase. None stops sampling.
+
+    The memory is the one of the whole process: the stages executed at the
+    same time by other threads share their peaks (see memory.Sampler), and
+    where only the peak of the process can be read (see memory.rss_source)
+    the increase is not the one of each stage.
+    """
+    global memory_sampler
+    if memory_sampler is not None:
+        memory_sampler.stop()
+        memory_sampler = None
+    if interval is not None:
+        memory_sampler = Sampler(interval)
+
+
+def _profiler(name):
+    """Return a new profiler if the stage has to be profiled. A stage
+    executed within a stage profiled in the same thread is not profiled on
+    its own: it appears in the profile of the outer stage."""
+    if name not in profile_stages and 'all' not in profile_stages:
+        return None
+    if getattr(_local, 'profiling', False):
+        return None
+    _local.profiling = True
+    return cProfile.Profile()
+
+
+def _dump_profile(profiler, name):
+    _local.profiling = False
+    filename = "%s_%s.prof" % (profile_prefix, name)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    profiler.dump_stats(filename)
+
+
+def add_listener(listener):
+    """Register a function to be called with each span which ends"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+@contextmanager
+def span(name, parent=None, verbose=None, stage=False, **attributes):
+    """
+    Measure the time spent executing the block.
+
+    The span is nested in the innermost span open in this thread or, when
+    given, in parent: a thread executing part of the work of a span started
+    by another thread has to pass it. Unless verbose is given, the span is
+    printed if its parent is (or, without a parent, if verbose is set).
+    A stage is profiled when selected through set_profile.
+    """
+    stack = _stack()
+    if parent is None and stack:
+        parent = stack[-1]
+    if verbose is None:
+        verbose = parent.verbose if parent is not None else get_verbose()
+    s = Span(name, parent, verbose, attributes)
+    if parent is not None:
+        parent.children.append(s)
+    profiler = None
+    if stage and profile_stages:
+        profiler = _profiler(name)
+    sampler = memory_sampler if stage else None
+    if sampler is not None:
+        sampler.watch(s)
+    stack.append(s)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield s
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _dump_profile(profiler, name)
+        if sampler is not None:
+            sampler.unwatch(s)
+        stack.pop()
+        s.end = time.time()
+        for listener in list(_listeners):
+            listener(s)
+
+
+def timed(function):
+    """Decorate a function so that each call is measured by a span named
+    after it, as a stage"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__, stage=True):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _summarize(spans):
+    """Merge the spans having the same name, keeping their order"""
+    names = []
+    merged = {}
+    for s in spans:
+        if s.name not in merged:
+            names.append(s.name)
+            merged[s.name] = []
+        merged[s.name].append(s)
+    summary = []
+    for name in names:
+        same = merged[name]
+        entry = {'name': name, 'count': len(same),
+                 'seconds': sum(s.duration for s in same)}
+        counters = {}
+        for s in same:
+            for k, v in s.counters.items():
+                counters[k] = counters.get(k, 0) + v
+            for k, v in s.maxima.items():
+                counters[k] = max(counters.get(k, v), v)
+        if counters:
+            entry['counters'] = counters
+        children = _summarize([c for s in same for c in s.children])
+        if children:
+            entry['children'] = children
+        summary.append(entry)
+    return summary
+
+
+class Recorder(object):
+    """A listener keeping the spans which end while it is registered"""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, s):
+        with self._lock:
+            self.spans.append(s)
+
+    def roots(self):
+        """The spans recorded which are not nested in other spans recorded"""
+        recorded = set(id(s) for s in self.spans)
+        return [s for s in self.spans
+                if s.parent is None or id(s.parent) not in recorded]
+
+    def summary(self):
+        """Return the time spent in the spans and their counters, the ones
+        with the same name and the same parents are merged"""
+        roots = self.roots()
+        return {'seconds': sum(s.duration for s in roots),
+                'spans': _summarize(sorted(roots, key=lambda s: s.start))}
+
+    def trace_events(self):
+        if not self.spans:
+            return []
+        origin = min(s.start for s in self.spans)
+        pid = os.getpid()
+        events = []
+        for s in sorted(self.spans, key=lambda s: s.start):
+            args = dict(s.attributes)
+            args.update(_metrics(s))
+            events.append({'name': s.name, 'cat': 'worldengine', 'ph': 'X',
+                           'ts': int((s.start - origin) * 1e6),
+                           'dur': int(s.duration * 1e6), 'pid': pid,
+                           'tid': s.thread, 'args': args})
+        return events
+
+    def write_summary(self, filename, **info):
+        """Write the summary as JSON, together with the given info"""
+        content = dict(info)
+        content.update(self.summary())
+        with open(filename, 'w') as f:
+            json.dump(content, f, indent=2, sort_keys=True)
+
+    def write_trace(self, filename):
+        """Write the spans in the Chrome trace-event format"""
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, f)
@@ -1,4 +1,6 @@
 import pickle
+import random
+import numpy
 
 from worldengine.biome import *
 from worldengine.basic_map_operations import *
@@ -7,11 +9,105 @@ from worldengine.step import Step
 
 execfile('worldengine/version.py')
 
+
+def _as_layer_array(data, dtype):
+    """Return the given matrix as a 2D numpy array with the given dtype.
+
+    It accepts both numpy arrays and nested lists (indexed as [y][x]), so
+    that code producing plain matrices keeps working.
+    """
+    return numpy.ascontiguousarray(data, dtype=dtype)
+
+
+def _biome_codes(biome):
+    """Return the given biome matrix as a uint8 array of biome indexes.
+
+    The matrix can contain either biome names or biome indexes (see
+    biome_name_to_index).
+    """
+    biome = numpy.asarray(biome)
+    if biome.dtype.kind in ('S', 'U', 'O'):
+        names, inverse = numpy.unique(biome, return_inverse=True)
+        codes = numpy.array([biome_name_to_index(n) for n in names],
+                            dtype=numpy.uint8)
+        biome = codes[inverse].reshape(biome.shape)
+    return _as_layer_array(biome, numpy.uint8)
+
+
+def _layers_equal(a, b):
+    if isinstance(a, numpy.ndarray) or isinstance(b, numpy.ndarray):
+        return numpy.array_equal(a, b)
+    return a == b
+
+
+class Layer(object):
+    """A layer of the world: a 2D numpy array with the thresholds or the
+    quantiles calculated on it.
+
+    The data are indexed as [y][x] (or [y, x]). A layer can also be accessed
+    as the dict used before layers were backed by numpy arrays, i.e.
+    layer['data'], layer['thresholds'] and layer['quantiles'].
+    """
+
+    _KEYS = ('data', 'thresholds', 'quantiles')
+
+    def __init__(self, data, thresholds=None, quantiles=None, dtype=float):
+        self.data = _as_layer_array(data, dtype)
+        self.thresholds = thresholds
+        self.quantiles = quantiles
+
+    def __getitem__(self, key):
+        if key not in Layer._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in Layer._KEYS:
+            raise KeyError(key)
+        if key == 'data':
+            value = _as_layer_array(value, self.data.dtype)
+        setattr(self, key, value)
+
+    def __eq__(self, other):
+        return isinstance(other, Layer) and \
+            numpy.array_equal(self.data, other.data) and \
+            self.thresholds == other.thresholds and \
+            self.quantiles == other.quantiles
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+
+# Classes returned by World.temperature_class_map(),
+# World.humidity_class_map() and World.elevation_class_map(): each cell
+# contains the index of its class in these lists
+TEMPERATURE_CLASSES = ['polar', 'alpine', 'boreal', 'cool', 'warm',
+                       'subtropical', 'tropical']
+HUMIDITY_CLASSES = ['superarid', 'perarid', 'arid', 'semiarid', 'subhumid',
+                    'humid', 'perhumid', 'superhumid']
+ELEVATION_CLASSES = ['ocean', 'plain', 'hill', 'mountain']
+
+# Humidity quantiles, from the driest to the most humid class
+_HUMIDITY_QUANTILES = ['87', '75', '62', '50', '37', '25', '12']
+
+
 class World(object):
     """A world composed by name, dimensions and all the characteristics of
     each cell.
     """
 
+    # class maps calculated on the layers, they are not serialized
+    _class_maps = None
+    # ids of the ocean basin of each cell, see set_ocean. They are not
+    # serialized by protobuf_serialize
+    _ocean_basins = None
+    # attributes which are not compared, as they are not serialized
+    _not_serialized = frozenset(['_class_maps', '_ocean_basins'])
+
     def __init__(self, name, width, height, seed, num_plates, ocean_level,
                  step):
         self.name = name
@@ -27,7 +123,51 @@ class World(object):
     #
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, World):
+            return False
+        if set(self.__dict__.keys()) - self._not_serialized != \
+                set(other.__dict__.keys()) - self._not_serialized:
+            return False
+        for k in self.__dict__:
+            if k in self._not_serialized:
+                continue
+            if not _layers_equal(self.__dict__[k], other.__dict__[k]):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_class_maps', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Worlds pickled before the layers were backed by numpy arrays
+        # contain nested lists and dicts: convert them
+        self._upgrade_layers()
+
+    def _upgrade_layers(self):
+        for name in ['elevation', 'precipitation', 'temperature',
+                     'permeability', 'watermap']:
+            layer = self.__dict__.get(name)
+            if isinstance(layer, dict):
+                self.__dict__[name] = Layer(layer['data'],
+                                            thresholds=layer['thresholds'])
+        if isinstance(self.__dict__.get('humidity'), dict):
+            self.humidity = Layer(self.humidity['data'],
+                                  quantiles=self.humidity['quantiles'])
+        for name, dtype in [('plates', numpy.uint16), ('ocean', bool),
+                            ('sea_depth', float), ('irrigation', float),
+                            ('river_map', numpy.float32),
+                            ('lake_map', numpy.float32)]:
+            layer = self.__dict__.get(name)
+            if isinstance(layer, list):
+                self.__dict__[name] = _as_layer_array(layer, dtype)
+        if isinstance(self.__dict__.get('biome'), list):
+            self.biome = _biome_codes(self.biome)
 
     #
     # Serialization/Unserialization
@@ -71,6 +211,9 @@ class World(object):
 
     @staticmethod
     def _to_protobuf_matrix(matrix, p_matrix, transformation=None):
+        if isinstance(matrix, numpy.ndarray):
+            # protobuf accepts only native Python values
+            matrix = matrix.tolist()
         for row in matrix:
             p_row = p_matrix.rows.add()
             for cell in row:
@@ -114,11 +257,9 @@ class World(object):
 
     @staticmethod
     def _from_protobuf_matrix_with_quantiles(p_matrix):
-        matrix = {}
-        matrix['data'] = World._from_protobuf_matrix(p_matrix)
-        matrix['quantiles'] = World._from_protobuf_quantiles(
-            p_matrix.quantiles)
-        return matrix
+        data = World._from_protobuf_matrix(p_matrix)
+        quantiles = World._from_protobuf_quantiles(p_matrix.quantiles)
+        return data, quantiles
 
     @staticmethod
     def worldengine_tag():
@@ -160,8 +301,7 @@ class World(object):
 
         # Biome
         if hasattr(self, 'biome'):
-            self._to_protobuf_matrix(self.biome, p_world.biome,
-                                     biome_name_to_index)
+            self._to_protobuf_matrix(self.biome, p_world.biome)
 
         # Humidty
         if hasattr(self, 'humidity'):
@@ -231,22 +371,20 @@ class World(object):
 
         # Ocean
         w.set_ocean(World._from_protobuf_matrix(p_world.ocean))
-        w.sea_depth = World._from_protobuf_matrix(p_world.sea_depth)
+        w.set_sea_depth(World._from_protobuf_matrix(p_world.sea_depth))
 
         # Biome
         if len(p_world.biome.rows) > 0:
-            w.set_biome(
-                World._from_protobuf_matrix(
-                    p_world.biome, biome_index_to_name))
+            w.set_biome(World._from_protobuf_matrix(p_world.biome))
 
         # Humidity
-        # FIXME: use setters
         if len(p_world.humidity.rows) > 0:
-            w.humidity = World._from_protobuf_matrix_with_quantiles(
+            data, quantiles = World._from_protobuf_matrix_with_quantiles(
                 p_world.humidity)
+            w.set_humidity(data, quantiles)
 
         if len(p_world.irrigation.rows) > 0:
-            w.irrigation = World._from_protobuf_matrix(p_world.irrigation)
+            w.set_irrigation(World._from_protobuf_matrix(p_world.irrigation))
 
         if len(p_world.permeabilityData.rows) > 0:
             p = World._from_protobuf_matrix(p_world.permeabilityData)
@@ -258,13 +396,12 @@ class World(object):
             w.set_permeability(p, p_th)
 
         if len(p_world.watermapData.rows) > 0:
-            w.watermap = {}
-            w.watermap['data'] = World._from_protobuf_matrix(
-                p_world.watermapData)
-            w.watermap['thresholds'] = {}
-            w.watermap['thresholds']['creek'] = p_world.watermap_creek
-            w.watermap['thresholds']['river'] = p_world.watermap_river
-            w.watermap['thresholds']['main river'] = p_world.watermap_mainriver
+            m = World._from_protobuf_matrix(p_world.watermapData)
+            th = {}
+            th['creek'] = p_world.watermap_creek
+            th['river'] = p_world.watermap_river
+            th['main river'] = p_world.watermap_mainriver
+            w.set_watermap(m, th)
 
         if len(p_world.precipitationData.rows) > 0:
             p = World._from_protobuf_matrix(p_world.precipitationData)
@@ -310,10 +447,10 @@ class World(object):
     # Land/Ocean
     #
 
-    def random_land(self):
-        x, y = random_point(self.width, self.height)
+    def random_land(self, rng=random):
+        x, y = random_point(self.width, self.height, rng)
         if self.ocean[y][x]:
-            return self.random_land()
+            return self.random_land(rng)
         else:
             return x, y
 
@@ -396,22 +533,10 @@ class World(object):
         return self.elevation['thresholds'][2][1]
 
     def max_elevation(self):
-        max_el = None
-        for y in xrange(self.height):
-            for x in xrange(self.width):
-                el = self.elevation['data'][y][x]
-                if max_el is None or el > max_el:
-                    max_el = el
-        return max_el
+        return self.elevation['data'].max()
 
     def min_elevation(self):
-        min_el = None
-        for y in xrange(self.height):
-            for x in xrange(self.width):
-                el = self.elevation['data'][y][x]
-                if min_el is None or el < min_el:
-                    min_el = el
-        return min_el
+        return self.elevation['data'].min()
 
     def is_mountain(self, pos):
         if not self.is_land(pos):
@@ -591,6 +716,106 @@ class World(object):
         t = self.humidity['data'][y][x]
         return t >= th_min
 
+    #
+    # Class maps
+    #
+
+    def _cached_class_map(self, name, layer, thresholds, calculate):
+        """Return the class map cached under the given name, calculating it
+        again if the layer or the thresholds have changed since then.
+
+        Changes done in place to the data of a layer are not detected: set
+        the layer again to invalidate the class maps depending on it.
+        """
+        if self._class_maps is None:
+            self._class_maps = {}
+        cached = self._class_maps.get(name)
+        if cached is not None:
+            c_layer, c_data, c_thresholds, class_map = cached
+            if c_layer is layer and c_data is layer['data'] and \
+                    c_thresholds == thresholds:
+                return class_map
+        class_map = calculate()
+        self._class_maps[name] = (layer, layer['data'], thresholds, class_map)
+        return class_map
+
+    def _invalidate_class_maps(self, *names):
+        if self._class_maps is not None:
+            for name in names:
+                self._class_maps.pop(name, None)
+
+    def temperature_class_map(self):
+        """Return an int8 array containing for each cell the index of its
+        temperature class in TEMPERATURE_CLASSES"""
+        ths = [th for _, th in self.temperature['thresholds'][:-1]]
+
+        def calculate():
+            return numpy.digitize(self.temperature['data'].ravel(),
+                                  ths).astype(numpy.int8).reshape(
+                self.temperature['data'].shape)
+
+        return self._cached_class_map('temperature', self.temperature, ths,
+                                      calculate)
+
+    def humidity_class_map(self):
+        """Return an int8 array containing for each cell the index of its
+        humidity class in HUMIDITY_CLASSES"""
+        ths = [self.humidity['quantiles'][q] for q in _HUMIDITY_QUANTILES]
+
+        def calculate():
+            return numpy.digitize(self.humidity['data'].ravel(),
+                                  ths).astype(numpy.int8).reshape(
+                self.humidity['data'].shape)
+
+        return self._cached_class_map('humidity', self.humidity, ths,
+                                      calculate)
+
+    def elevation_class_map(self):
+        """Return an int8 array containing for each cell the index of its
+        elevation class in ELEVATION_CLASSES. Hills and mountains are
+        classified as is_hill and is_mountain do."""
+        if len(self.elevation['thresholds']) == 4:
+            hi = 1
+        else:
+            hi = 0
+        hill_level = self.elevation['thresholds'][hi][1]
+        mountain_level = self.elevation['thresholds'][hi + 1][1]
+        ths = [hill_level, mountain_level]
+
+        def calculate():
+            e = self.elevation['data']
+            # 1 (plain) up to the hill level included, 2 (hill) up to the
+            # mountain level included, 3 (mountain) above it
+            class_map = numpy.digitize(e.ravel(), ths,
+                                       right=True).reshape(e.shape) + 1
+            class_map = class_map.astype(numpy.int8)
+            # a cell exactly at the mountain level is neither a hill nor
+            # a mountain
+            class_map[e == mountain_level] = 1
+            class_map[self.ocean] = 0
+            return class_map
+
+        return self._cached_class_map('elevation', self.elevation, ths,
+                                      calculate)
+
+    #
+    # Memory
+    #
+
+    def memory_report(self):
+        """Return the bytes held by each layer of the world, and by the
+        class maps calculated on them"""
+        report = {}
+        for name, value in self.__dict__.items():
+            if isinstance(value, Layer):
+                report[name] = value.data.nbytes
+            elif isinstance(value, numpy.ndarray):
+                report[name.lstrip('_')] = value.nbytes
+        if self._class_maps:
+            report['class_maps'] = sum(entry[3].nbytes for entry in
+                                       self._class_maps.values())
+        return report
+
     #
     # Streams
     #
@@ -626,7 +851,7 @@ class World(object):
 
     def biome_at(self, pos):
         x, y = pos
-        b = Biome.by_name(self.biome[y][x])
+        b = Biome.by_name(biome_index_to_name(self.biome.item(y, x)))
         if b is None:
             raise Exception('Not found')
         return b
@@ -770,77 +995,84 @@ class World(object):
     #
 
     def n_actual_plates(self):
-        res = -1
-        for row in self.plates:
-            for cell in row:
-                res = max([cell, res])
-        return res + 1
+        return int(self.plates.max()) + 1
 
     #
     # Setters
     #
 
-    def set_elevation(self, data, thresholds):
+    def _check_dimensions(self, data, name):
         if (len(data) != self.height) or (len(data[0]) != self.width):
             raise Exception(
-                "Setting elevation map with wrong dimension. " +
-                "Expected %d x %d, found %d x %d" % (
-                    self.width, self.height, (len[data[0]], len(data))))
-        self.elevation = {'data': data, 'thresholds': thresholds}
+                ("Setting %s map with wrong dimension. " +
+                 "Expected %d x %d, found %d x %d") % (
+                    name, self.width, self.height, len(data[0]), len(data)))
+
+    def set_elevation(self, data, thresholds):
+        self._check_dimensions(data, 'elevation')
+        self.elevation = Layer(data, thresholds=thresholds)
+        self._invalidate_class_maps('elevation')
 
     def set_plates(self, data):
-        if (len(data) != self.height) or (len(data[0]) != self.width):
-            raise Exception(
-                "Setting plates map with wrong dimension. " +
-                "Expected %d x %d, found %d x %d" % (
-                    self.width, self.height, (len[data[0]], len(data))))
-        self.plates = data
+        self._check_dimensions(data, 'plates')
+        self.plates = _as_layer_array(data, numpy.uint16)
 
     def set_biome(self, biome):
+        """Biome is stored as a matrix of biome indexes: it is possible to
+        pass either the names of the biomes or their indexes"""
         if len(biome) != self.height:
             raise Exception(
-                "Setting data with wrong height: biome has height %i while " +
-                "the height is currently %i" % (
+                ("Setting data with wrong height: biome has height %i " +
+                 "while the height is currently %i") % (
                     len(biome), self.height))
         if len(biome[0]) != self.width:
             raise Exception("Setting data with wrong width")
 
-        self.biome = biome
+        self.biome = _biome_codes(biome)
 
-    def set_ocean(self, ocean):
-        if (len(ocean) != self.height) or (len(ocean[0]) != self.width):
-            raise Exception(
-                "Setting ocean map with wrong dimension. Expected %d x %d, " +
-                "found %d x %d" % (self.width, self.height,
-                                   len(ocean[0]), len(ocean)))
+    def set_ocean(self, ocean, basins=None):
+        """The basins, when given, are the ids of the ocean basin of each
+        cell (see generation.fill_ocean). They are not serialized."""
+        self._check_dimensions(ocean, 'ocean')
+        self.ocean = _as_layer_array(ocean, bool)
+        if basins is not None:
+            self._check_dimensions(basins, 'ocean basins')
+            self._ocean_basins = _as_layer_array(basins, numpy.int32)
+        else:
+            # they would not match the new ocean
+            self.__dict__.pop('_ocean_basins', None)
+        self._invalidate_class_maps('elevation')
 
-        self.ocean = ocean
+    def set_sea_depth(self, data):
+        self._check_dimensions(data, 'sea depth')
+        self.sea_depth = _as_layer_array(data, float)
 
     def set_precipitation(self, data, thresholds):
         """"Precipitation is a value in [-1,1]"""
-
-        if len(data) != self.height:
-            raise Exception("Setting data with wrong height")
-        if len(data[0]) != self.width:
-            raise Exception("Setting data with wrong width")
-
-        self.precipitation = {'data': data, 'thresholds': thresholds}
+        self._check_dimensions(data, 'precipitation')
+        self.precipitation = Layer(data, thresholds=thresholds)
 
     def set_temperature(self, data, thresholds):
-        if len(data) != self.height:
-            raise Exception("Setting data with wrong height")
-        if len(data[0]) != self.width:
-            raise Exception("Setting data with wrong width")
-
-        self.temperature = {'data': data, 'thresholds': thresholds}
+        self._check_dimensions(data, 'temperature')
+        self.temperature = Layer(data, thresholds=thresholds)
+        self._invalidate_class_maps('temperature')
 
     def set_permeability(self, data, thresholds):
-        if len(data) != self.height:
-            raise Exception("Setting data with wrong height")
-        if len(data[0]) != self.width:
-            raise Exception("Setting data with wrong width")
+        self._check_dimensions(data, 'permeability')
+        self.permeability = Layer(data, thresholds=thresholds)
+
+    def set_watermap(self, data, thresholds):
+        self._check_dimensions(data, 'watermap')
+        self.watermap = Layer(data, thresholds=thresholds)
+
+    def set_irrigation(self, data):
+        self._check_dimensions(data, 'irrigation')
+        self.irrigation = _as_layer_array(data, float)
 
-        self.permeability = {'data': data, 'thresholds': thresholds}
+    def set_humidity(self, data, quantiles):
+        self._check_dimensions(data, 'humidity')
+        self.humidity = Layer(data, quantiles=quantiles)
+        self._invalidate_class_maps('humidity')
 
     def has_precipitations(self):
         return hasattr(self, 'precipitation')
@@ -863,8 +1095,25 @@ class World(object):
     def has_biome(self):
         return hasattr(self, 'biome')
 
+    def has_ocean(self):
+        return hasattr(self, 'ocean')
+
+    @property
+    def ocean_basins(self):
+        """The ids of the ocean basin of each cell, 0 for the cells not in
+        the ocean, or None when they are not known"""
+        return self._ocean_basins
+
+    def has_ocean_basins(self):
+        return self._ocean_basins is not None
+
+    def has_rivermap(self):
+        return hasattr(self, 'river_map')
+
     def set_rivermap(self, river_map):
-        self.river_map = river_map
+        self._check_dimensions(river_map, 'river')
+        self.river_map = _as_layer_array(river_map, numpy.float32)
 
     def set_lakemap(self, lake_map):
-        self.lake_map = lake_map
+        self._check_dimensions(lake_map, 'lake')
+        self.lake_map = _as_layer_array(lake_map, numpy.float32)